@@ -0,0 +1,73 @@
+import os
+import time
+from fastapi import HTTPException
+from api.models.models import CreditReservation
+from api.functions.supabase import get_subscription_plan, reserve_search_credit, refund_search_credit
+
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", "60"))
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "10000"))
+
+# user_id -> (scadenza, piano), solo per i piani a pagamento che non vengono mai scalati
+paid_users = {}
+
+def get_cached_paid_plan(user_id: str) -> str | None:
+    cached = paid_users.get(user_id)
+    if cached is None:
+        return None
+    if cached[0] < time.monotonic():
+        del paid_users[user_id]
+        return None
+    return cached[1]
+
+def cache_plan(user_id: str, plan: str) -> None:
+    if plan == "free":
+        paid_users.pop(user_id, None)
+        return
+
+    if len(paid_users) >= PLAN_CACHE_SIZE:
+        now = time.monotonic()
+        for cached_user_id, (expires_at, _) in list(paid_users.items()):
+            if expires_at < now:
+                del paid_users[cached_user_id]
+        if len(paid_users) >= PLAN_CACHE_SIZE:
+            paid_users.pop(next(iter(paid_users)))
+    paid_users[user_id] = (time.monotonic() + PLAN_CACHE_TTL, plan)
+
+async def has_credits(user_id: str) -> bool:
+    """ Whether the user can run a search, without spending a credit.
+    Paid plans are cached for PLAN_CACHE_TTL seconds. """
+    if get_cached_paid_plan(user_id):
+        return True
+
+    subscription = await get_subscription_plan(user_id)
+    if not subscription:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+
+    cache_plan(user_id, subscription["plan"])
+    return not (subscription["plan"] == "free" and subscription["credits"] <= 0)
+
+async def reserve_credit(user_id: str) -> CreditReservation:
+    """ Reserve the credit of a search before it starts. Raises a 400 when a free plan has no
+    credits left. Paid plans known from the cache skip the database entirely. """
+    plan = get_cached_paid_plan(user_id)
+    if plan:
+        return CreditReservation(plan=plan, allowed=True, reserved=False)
+
+    reservation = await reserve_search_credit(user_id)
+    cache_plan(user_id, reservation.plan)
+
+    if not reservation.allowed:
+        raise HTTPException(status_code=400, detail="Insufficient credits")
+    return reservation
+
+async def refund_credit(user_id: str, reservation: CreditReservation) -> None:
+    """ Give back the credit of a failed search. Errors are logged, a failed search must not fail twice. """
+    if not reservation.reserved:
+        return
+
+    try:
+        credits = await refund_search_credit(user_id)
+        reservation.credits = credits
+        reservation.reserved = False
+    except Exception as e:
+        print(f"Error refunding credit: {str(e)}")
@@ -0,0 +1,96 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "64"))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "10"))
+
+class EmbeddingBatcher:
+    """ Single thread that owns the model and serves encode requests from every
+    concurrent search. Requests arriving within max_wait_ms of each other are merged
+    into one micro-batch of at most max_batch_size texts. """
+
+    def __init__(self, encode, max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE, max_wait_ms: float = EMBEDDING_MAX_WAIT_MS):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.stats = {"requests": 0, "batches": 0, "texts": 0}
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+    def submit(self, texts: list) -> Future:
+        """ Queue texts for encoding, the future resolves to a (len(texts), D) tensor. """
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="embedding-batcher", daemon=True)
+                self.thread.start()
+
+        future = Future()
+        self.requests.put((texts, future))
+        return future
+
+    def collect_batch(self) -> list:
+        """ Wait for a request, then keep collecting until the batch is full or the deadline passes. """
+        batch = [self.requests.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[0])
+
+        return batch
+
+    def encode_batch(self, batch: list) -> None:
+        # Le richieste già cancellate (es. uno stream chiuso dal client) non vanno codificate
+        batch = [(texts, future) for texts, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        # Testi identici di richieste diverse vengono codificati una volta sola
+        unique_texts = list(dict.fromkeys(text for texts, _ in batch for text in texts))
+        positions = {text: i for i, text in enumerate(unique_texts)}
+
+        try:
+            vectors = self.encode(unique_texts)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for texts, future in batch:
+            future.set_result(vectors[[positions[text] for text in texts]])
+
+        self.stats["requests"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["texts"] += len(unique_texts)
+
+    def run(self) -> None:
+        while True:
+            batch = self.collect_batch()
+            try:
+                self.encode_batch(batch)
+            except Exception as e:
+                # Il thread serve tutte le ricerche, non deve mai terminare
+                print(f"Error in embedding batcher: {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def get_stats(self) -> dict:
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "avg_batch_size": self.stats["texts"] / batches if batches else 0.0,
+            "queued": self.requests.qsize(),
+        }
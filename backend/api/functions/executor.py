@@ -0,0 +1,37 @@
+import os
+import asyncio
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 1)))
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Executor dedicato al lavoro CPU-bound (parsing dei CV, scoring),
+# così l'event loop resta libero di servire le altre richieste
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+
+async def run_in_cpu_executor(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, partial(func, *args, **kwargs))
+
+process_executor: ProcessPoolExecutor | None = None
+
+def get_process_executor() -> ProcessPoolExecutor:
+    """ Process pool for pure-Python parsing that would hold the GIL in the thread pool,
+    created on first use. Uses spawn, forking a process that runs torch threads is unsafe. """
+    global process_executor
+    if process_executor is None:
+        process_executor = ProcessPoolExecutor(max_workers=PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return process_executor
+
+async def run_in_process_executor(func, *args):
+    """ func and its arguments must be picklable, i.e. module-level functions and plain data. """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_executor(), func, *args)
+
+def shutdown_process_executor() -> None:
+    global process_executor
+    if process_executor is not None:
+        process_executor.shutdown(cancel_futures=True)
+        process_executor = None
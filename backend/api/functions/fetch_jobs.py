@@ -1,22 +1,92 @@
 import os
+import re
+import time
+import asyncio
+from collections import OrderedDict
 from fastapi import HTTPException
-import requests
+import httpx
+from api.functions.metrics import instrumented, timed_stage
 
-def fetch_jobs_from_api(role: str, location: str):
+JSEARCH_URL = os.getenv("JSEARCH_URL", "https://jsearch.p.rapidapi.com/search")
+JSEARCH_TIMEOUT = float(os.getenv("JSEARCH_TIMEOUT", "30"))
+JSEARCH_POOL_SIZE = int(os.getenv("JSEARCH_POOL_SIZE", "10"))
+JSEARCH_CACHE_TTL = int(os.getenv("JSEARCH_CACHE_TTL", "600"))
+JSEARCH_CACHE_SIZE = int(os.getenv("JSEARCH_CACHE_SIZE", "256"))
+
+http_client: httpx.AsyncClient | None = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """ Async client shared by all searches to reuse keep-alive connections to JSearch, created on first use. """
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            timeout=JSEARCH_TIMEOUT,
+            limits=httpx.Limits(max_connections=JSEARCH_POOL_SIZE, max_keepalive_connections=JSEARCH_POOL_SIZE),
+        )
+    return http_client
+
+jobs_cache = OrderedDict()
+jobs_in_flight = {}
+
+def normalize_query_value(value: str) -> str:
+    return re.sub(r"\s+", " ", value or "").strip().lower()
+
+@instrumented("jsearch")
+async def request_jobs(role: str, location: str, country: str, page: int) -> list:
+    querystring = {"query": f"{role} in {location}", "page": str(page), "num_pages": "1", "country": country}
+
+    headers = {
+        "X-RapidAPI-Key": os.getenv("RAPIDAPI_KEY", ""),
+        "X-RapidAPI-Host": "jsearch.p.rapidapi.com"
+    }
+
+    response = await get_http_client().get(JSEARCH_URL, headers=headers, params=querystring)
+
+    if response.status_code == 200:
+        return response.json().get("data", [])
+    else:
+        raise HTTPException(status_code=500, detail=f"Error searching jobs: {response.status_code}")
+
+async def load_jobs(key: tuple, role: str, location: str, country: str, page: int) -> list:
+    """ Upstream call shared by the identical queries in flight, cached on success. """
     try:
-        url = "https://jsearch.p.rapidapi.com/search"
-        querystring = {"query": f"{role} in {location}", "page": "1", "num_pages": "1", "country": "it"}
-        
-        headers = {
-            "X-RapidAPI-Key": os.getenv("RAPIDAPI_KEY"),
-            "X-RapidAPI-Host": "jsearch.p.rapidapi.com"
-        }
-
-        response = requests.get(url, headers=headers, params=querystring)
-
-        if response.status_code == 200:
-            return response.json().get("data", [])
-        else:
-            raise HTTPException(status_code=500, detail=f"Error searching jobs: {response.status_code}")
+        jobs = await request_jobs(role, location, country, page)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error searching jobs: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error searching jobs: {e}")
+    finally:
+        jobs_in_flight.pop(key, None)
+
+    jobs_cache[key] = (time.monotonic() + JSEARCH_CACHE_TTL, jobs)
+    jobs_cache.move_to_end(key)
+    while len(jobs_cache) > JSEARCH_CACHE_SIZE:
+        jobs_cache.popitem(last=False)
+    return jobs
+
+@timed_stage("fetch_jobs")
+async def fetch_jobs_from_api(role: str, location: str, country: str = "it", page: int = 1):
+    """ Fetch JSearch results, cached for JSEARCH_CACHE_TTL seconds per normalized
+    (role, location, country, page). Concurrent identical queries share one upstream call,
+    run in its own task so a cancelled caller does not cancel the others. """
+    key = (normalize_query_value(role), normalize_query_value(location), country, page)
+
+    cached = jobs_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        jobs_cache.move_to_end(key)
+        return list(cached[1])
+
+    task = jobs_in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(load_jobs(key, role, location, country, page))
+        # Evita il warning "exception was never retrieved" quando nessuno è in attesa
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        jobs_in_flight[key] = task
+
+    return list(await asyncio.shield(task))
+
+async def close_http_client() -> None:
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
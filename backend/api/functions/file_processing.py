@@ -1,19 +1,125 @@
 import io
+import os
 import re
+import asyncio
 from fastapi import UploadFile
 import PyPDF2
 import docx
+from docx.table import Table
 from fastapi import HTTPException
+from api.functions.executor import run_in_cpu_executor, run_in_process_executor, PROCESS_WORKERS
+from api.functions.metrics import timed_stage
 
-def extract_text_from_pdf(file: UploadFile) -> str:
-    reader = PyPDF2.PdfReader(file.file)
-    text = "".join(page.extract_text() or "" for page in reader.pages)
-    return text.strip()
+CV_MAX_BYTES = int(os.getenv("CV_MAX_BYTES", str(10 * 1024 * 1024)))
+# Margine per gli altri campi del form e i separatori multipart
+CV_MAX_REQUEST_BYTES = CV_MAX_BYTES + 64 * 1024
+# Il prompt del riepilogo viene comunque troncato, non serve estrarre tutto il documento
+CV_MAX_PAGES = int(os.getenv("CV_MAX_PAGES", "30"))
+CV_MAX_CHARS = int(os.getenv("CV_MAX_CHARS", "30000"))
+CV_PARALLEL_MIN_PAGES = int(os.getenv("CV_PARALLEL_MIN_PAGES", "12"))
+CV_PAGES_PER_TASK = int(os.getenv("CV_PAGES_PER_TASK", "4"))
 
-def extract_text_from_docx(file: UploadFile) -> str:
-    doc = docx.Document(io.BytesIO(file.file.read()))
-    text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-    return text.strip()
+def check_upload_size(file: UploadFile, max_bytes: int = CV_MAX_BYTES) -> None:
+    """ Reject an upload larger than max_bytes with a 413. """
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File too large, the maximum size is {max_bytes // (1024 * 1024)} MB")
+
+def open_pdf(stream) -> tuple:
+    """ Reader of an uploaded PDF and the number of pages to extract, at most CV_MAX_PAGES. """
+    reader = PyPDF2.PdfReader(stream)
+    return reader, min(len(reader.pages), CV_MAX_PAGES)
+
+def split_pdf_pages(reader: PyPDF2.PdfReader, start: int, stop: int) -> bytes:
+    """ Pages [start, stop) as a standalone PDF, so a pool task receives and parses only its pages. """
+    writer = PyPDF2.PdfWriter()
+    for i in range(start, stop):
+        writer.add_page(reader.pages[i])
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+def extract_pdf_pages(data: bytes) -> str:
+    """ Text of a PDF built by split_pdf_pages, run in the process pool for large documents. """
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    return "".join(page.extract_text() or "" for page in reader.pages)
+
+def extract_text_from_pdf_reader(reader: PyPDF2.PdfReader, max_pages: int = CV_MAX_PAGES, max_chars: int = CV_MAX_CHARS) -> str:
+    """ Extract pages in order, stopping after max_pages pages or max_chars characters. """
+    texts = []
+    length = 0
+    for page in reader.pages[:max_pages]:
+        text = page.extract_text() or ""
+        texts.append(text)
+        length += len(text)
+        if length >= max_chars:
+            break
+    return "".join(texts)[:max_chars].strip()
+
+def extract_text_from_pdf(stream, max_pages: int = CV_MAX_PAGES, max_chars: int = CV_MAX_CHARS) -> str:
+    return extract_text_from_pdf_reader(PyPDF2.PdfReader(stream), max_pages, max_chars)
+
+async def extract_text_from_large_pdf(reader: PyPDF2.PdfReader, page_count: int, max_chars: int = CV_MAX_CHARS) -> str:
+    """ Extract ranges of CV_PAGES_PER_TASK pages in the process pool, PROCESS_WORKERS ranges at a time.
+    Like extract_text_from_pdf it stops early: no range is submitted once the pages already
+    extracted, in order, hold max_chars characters. """
+    ranges = [(start, min(start + CV_PAGES_PER_TASK, page_count)) for start in range(0, page_count, CV_PAGES_PER_TASK)]
+    texts = [None] * len(ranges)
+    pending = {}
+    submitted, extracted, length = 0, 0, 0
+    try:
+        while extracted < len(ranges) and length < max_chars:
+            while submitted < len(ranges) and len(pending) < PROCESS_WORKERS:
+                # Il reader non è thread-safe: le pagine si copiano una range alla volta
+                data = await run_in_cpu_executor(split_pdf_pages, reader, *ranges[submitted])
+                pending[asyncio.ensure_future(run_in_process_executor(extract_pdf_pages, data))] = submitted
+                submitted += 1
+
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                texts[pending.pop(task)] = task.result()
+            # Conta solo il prefisso già completo, il testo va restituito in ordine
+            while extracted < len(ranges) and texts[extracted] is not None:
+                length += len(texts[extracted])
+                extracted += 1
+    finally:
+        for task in pending:
+            task.cancel()
+
+    return "".join(texts[:extracted])[:max_chars].strip()
+
+def iter_docx_texts(container):
+    """ Paragraphs and table rows of a document, header or footer in document order. """
+    for block in container.iter_inner_content():
+        if isinstance(block, Table):
+            for row in block.rows:
+                # Le celle unite compaiono più volte nella stessa riga
+                cells = list(dict.fromkeys(cell.text.strip() for cell in row.cells))
+                yield " | ".join(cell for cell in cells if cell)
+        else:
+            yield block.text
+
+def extract_text_from_docx(stream, max_chars: int = CV_MAX_CHARS) -> str:
+    """ Extract headers, body paragraphs and tables, then footers, stopping after max_chars characters. """
+    doc = docx.Document(stream)
+
+    headers, footers = [], []
+    for section in doc.sections:
+        if not section.header.is_linked_to_previous:
+            headers.append(section.header)
+        if not section.footer.is_linked_to_previous:
+            footers.append(section.footer)
+
+    texts = []
+    length = 0
+    for container in headers + [doc] + footers:
+        for text in iter_docx_texts(container):
+            if not text:
+                continue
+            texts.append(text)
+            length += len(text) + 1
+            if length >= max_chars:
+                return "\n".join(texts)[:max_chars].strip()
+    return "\n".join(texts).strip()
 
 def clean_text(text: str) -> str:
     text = re.sub(r'\s+', ' ', text)
@@ -22,6 +128,16 @@ def clean_text(text: str) -> str:
     text = text.replace('\r', '\n')
     return text.strip()
 
+async def extract_cv_text(stream, file_extension: str) -> str:
+    if file_extension == "docx":
+        return await run_in_cpu_executor(extract_text_from_docx, stream)
+
+    reader, page_count = await run_in_cpu_executor(open_pdf, stream)
+    if PROCESS_WORKERS > 1 and page_count >= CV_PARALLEL_MIN_PAGES:
+        return await extract_text_from_large_pdf(reader, page_count)
+    return await run_in_cpu_executor(extract_text_from_pdf_reader, reader)
+
+@timed_stage("process_cv")
 async def process_cv(file: UploadFile) -> str:
     if not file.filename:
         raise HTTPException(status_code=400, detail="File not valid or not provided")
@@ -30,12 +146,12 @@ async def process_cv(file: UploadFile) -> str:
     if file_extension not in ['pdf', 'docx']:
         raise HTTPException(status_code=400, detail="Only PDF or DOCX files are supported")
 
+    # Starlette ha già salvato l'upload in un file temporaneo, si legge direttamente da lì
+    check_upload_size(file)
     try:
-        if file.content_type == "application/pdf":
-            text = extract_text_from_pdf(file)
-        else:
-            text = extract_text_from_docx(file)
-        return clean_text(text)
+        # Il parsing è CPU-bound, va eseguito fuori dall'event loop
+        text = await extract_cv_text(file.file, file_extension)
+        return await run_in_cpu_executor(clean_text, text)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing CV: {e}")
     
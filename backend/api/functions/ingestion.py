@@ -0,0 +1,174 @@
+import os
+import asyncio
+from typing import AsyncIterator, Callable
+from api.functions.supabase import get_existing_job_posts, build_job_post, upsert_job_posts, update_job_requirements
+from api.functions.openai import get_job_requirements_batch, REQUIREMENTS_BATCH_SIZE
+from api.functions.metrics import track_stage
+
+JOB_INGESTION_CONCURRENCY = int(os.getenv("JOB_INGESTION_CONCURRENCY", "5"))
+
+# job_id -> future con la riga salvata (None se il job viene scartato), condivisa tra le ricerche concorrenti
+in_flight_jobs = {}
+enrichment_tasks = set()
+
+async def build_job_post_batch(batch: list, on_job_built: Callable | None = None) -> list:
+    """ Extract the requirements of a batch of jobs with one LLM call and build their job posts.
+    Single jobs whose extraction failed are skipped; raises LLMError if the whole batch fails. """
+    requirements = await get_job_requirements_batch(
+        {job["job_id"]: job.get("job_description") or "" for job in batch}
+    )
+
+    job_posts = []
+    for job in batch:
+        # Estrazione fallita: meglio non salvare il job che salvarlo senza requisiti
+        if job["job_id"] not in requirements:
+            continue
+        try:
+            job_post = build_job_post(job, requirements[job["job_id"]])
+            if on_job_built:
+                on_job_built(job_post)
+            job_posts.append(job_post)
+        except Exception as e:
+            print(f"Error saving job: {str(e)}")
+    return job_posts
+
+def split_job_batches(jobs: list) -> list:
+    return [jobs[i:i + REQUIREMENTS_BATCH_SIZE] for i in range(0, len(jobs), REQUIREMENTS_BATCH_SIZE)]
+
+async def store_job_batch(batch: list, on_job_built: Callable | None = None) -> None:
+    """ Extract requirements for a batch of jobs owned by this process and upsert them,
+    then resolve the in-flight futures of the batch for every search waiting on them.
+    If the batch fails its futures resolve to the error, so the searches skip these jobs
+    instead of failing. """
+    stored, error = {}, None
+    try:
+        job_posts = await build_job_post_batch(batch, on_job_built)
+        if job_posts:
+            with track_stage("job_insert"):
+                stored = await upsert_job_posts(job_posts)
+    except Exception as e:
+        print(f"Error saving job posts: {str(e)}")
+        error = e
+    finally:
+        for job in batch:
+            future = in_flight_jobs.pop(job["job_id"])
+            future.set_result(error if error is not None else stored.get(job["job_id"]))
+
+async def enrich_job_batch(batch: list, on_job_built: Callable | None = None, on_batch_failed: Callable | None = None) -> list:
+    """ Store a batch of new jobs, running requirement extraction once per job_id.
+    Jobs already being enriched by a concurrent search are awaited instead of sent to the LLM
+    again. The work runs in its own task, so a search that is cancelled (e.g. a closed stream)
+    does not fail the other searches waiting on the same jobs.
+    Returns the stored rows in batch order, skipped jobs are left out. Jobs of a failed batch
+    are left out too, and on_batch_failed is called with the error. """
+    loop = asyncio.get_running_loop()
+    owned, futures = [], []
+    for job in batch:
+        future = in_flight_jobs.get(job["job_id"])
+        if future is None:
+            future = in_flight_jobs[job["job_id"]] = loop.create_future()
+            owned.append(job)
+        futures.append(future)
+
+    if owned:
+        task = asyncio.ensure_future(store_job_batch(owned, on_job_built))
+        enrichment_tasks.add(task)
+        task.add_done_callback(enrichment_tasks.discard)
+
+    with track_stage("requirements"):
+        rows = await asyncio.shield(asyncio.gather(*futures))
+
+    errors = [row for row in rows if isinstance(row, Exception)]
+    if errors and on_batch_failed:
+        on_batch_failed(errors[0])
+    return [row for row in rows if row is not None and not isinstance(row, Exception)]
+
+async def enrich_jobs(jobs: list, max_concurrency: int = JOB_INGESTION_CONCURRENCY, on_job_built: Callable | None = None,
+                      on_batch_failed: Callable | None = None) -> dict:
+    """ Enrich and store new jobs in batches of REQUIREMENTS_BATCH_SIZE descriptions,
+    running at most max_concurrency batches at a time. Returns stored rows by job_id.
+    on_job_built is called after each successful extraction, e.g. to report progress,
+    on_batch_failed with the error of each batch that could not be stored. """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def enrich(batch: list) -> list:
+        async with semaphore:
+            return await enrich_job_batch(batch, on_job_built, on_batch_failed)
+
+    enriched_batches = await asyncio.gather(*(enrich(batch) for batch in split_job_batches(jobs)))
+    return {row["job_id"]: row for rows in enriched_batches for row in rows}
+
+def unique_jobs_by_id(jobs: list) -> dict:
+    # JSearch can return the same post twice, job_report_posts is unique per report
+    unique_jobs = {}
+    for job in jobs:
+        if job.get("job_id") and job["job_id"] not in unique_jobs:
+            unique_jobs[job["job_id"]] = job
+    return unique_jobs
+
+async def save_job_posts(jobs: list, max_concurrency: int = JOB_INGESTION_CONCURRENCY, on_job_built: Callable | None = None,
+                         on_batch_failed: Callable | None = None) -> list:
+    """ Resolve the jobs of a search against job_posts and store the missing ones.
+    Known jobs are fetched with a single query, only new jobs go through enrichment.
+    Saved jobs are returned in the original order. """
+    unique_jobs = unique_jobs_by_id(jobs)
+
+    with track_stage("job_lookup"):
+        saved_jobs = await get_existing_job_posts(list(unique_jobs))
+
+    new_jobs = [job for job_id, job in unique_jobs.items() if job_id not in saved_jobs]
+    if new_jobs:
+        saved_jobs.update(await enrich_jobs(new_jobs, max_concurrency, on_job_built, on_batch_failed))
+
+    return [saved_jobs[job_id] for job_id in unique_jobs if job_id in saved_jobs]
+
+async def iter_saved_job_posts(jobs: list, max_concurrency: int = JOB_INGESTION_CONCURRENCY, on_batch_failed: Callable | None = None) -> AsyncIterator[list]:
+    """ Streaming variant of save_job_posts: yields lists of saved rows as soon as they are
+    available, first the jobs already stored, then each batch of new jobs once it is
+    enriched and stored, in completion order. """
+    unique_jobs = unique_jobs_by_id(jobs)
+
+    with track_stage("job_lookup"):
+        saved_jobs = await get_existing_job_posts(list(unique_jobs))
+    if saved_jobs:
+        yield [saved_jobs[job_id] for job_id in unique_jobs if job_id in saved_jobs]
+
+    new_jobs = [job for job_id, job in unique_jobs.items() if job_id not in saved_jobs]
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def save(batch: list) -> list:
+        async with semaphore:
+            return await enrich_job_batch(batch, on_batch_failed=on_batch_failed)
+
+    tasks = [asyncio.ensure_future(save(batch)) for batch in split_job_batches(new_jobs)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            rows = await task
+            if rows:
+                yield rows
+    finally:
+        # Il client può chiudere lo stream prima della fine
+        for task in tasks:
+            task.cancel()
+
+async def refresh_job_requirements(rows: list, max_concurrency: int = JOB_INGESTION_CONCURRENCY) -> dict:
+    """ Re-extract the requirements of stored job posts and write them back in bulk.
+    Returns the new requirements by job_id, jobs whose extraction failed are left unchanged. """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def refresh(batch: list) -> dict:
+        async with semaphore:
+            try:
+                requirements = await get_job_requirements_batch(
+                    {row["job_id"]: row.get("description") or "" for row in batch}
+                )
+            except Exception as e:
+                print(f"Error extracting job requirements: {str(e)}")
+                return {}
+            await update_job_requirements(batch, requirements)
+            return requirements
+
+    refreshed = {}
+    for requirements in await asyncio.gather(*(refresh(batch) for batch in split_job_batches(rows))):
+        refreshed.update(requirements)
+    return refreshed
@@ -0,0 +1,137 @@
+import os
+import asyncio
+import threading
+import torch
+import torch.nn.functional as F
+from api.functions.supabase import get_job_embeddings_page, get_job_posts_by_ids
+from api.functions.executor import run_in_cpu_executor
+
+# Ogni worker tiene il proprio indice: 3 vettori fp32 da 768 dimensioni, ~9 KB per job,
+# quindi ~180 MB per processo con JOB_INDEX_MAX_SIZE=20000. Oltre il limite si sostituiscono i job più vecchi
+JOB_INDEX_ENABLED = os.getenv("JOB_INDEX_ENABLED", "true").lower() == "true"
+JOB_INDEX_MAX_SIZE = int(os.getenv("JOB_INDEX_MAX_SIZE", "20000"))
+JOB_INDEX_PRELOAD = os.getenv("JOB_INDEX_PRELOAD", "false").lower() == "true"
+JOB_INDEX_PAGE_SIZE = int(os.getenv("JOB_INDEX_PAGE_SIZE", "500"))
+LOCAL_SEARCH_TOP_K = int(os.getenv("LOCAL_SEARCH_TOP_K", "20"))
+
+# Pesi di ruolo, location e skills per il recupero, come in score_job_vectors per i job senza esperienza
+RETRIEVAL_WEIGHTS = torch.tensor([0.30, 0.20, 0.50])
+
+class JobVectorIndex:
+    """ Exact in-memory nearest neighbour index over the stored job vectors.
+    Keeps the normalized (N, 3, D) role, location and skills vectors with their text hash,
+    so it also serves get_job_vectors without a round-trip to the embedding store.
+    A flat scan is a single matrix product, a few ms for tens of thousands of jobs.
+    Holds at most max_size jobs, then new jobs replace the oldest ones. """
+
+    def __init__(self, max_size: int = JOB_INDEX_MAX_SIZE):
+        self.max_size = max_size
+        self.vectors = None
+        self.size = 0
+        self.next_eviction = 0
+        self.job_post_ids = []
+        self.text_hashes = []
+        self.positions = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def grow(self, capacity: int, dimension: int) -> None:
+        vectors = torch.empty(capacity, 3, dimension)
+        if self.vectors is not None:
+            vectors[:self.size] = self.vectors[:self.size]
+        self.vectors = vectors
+
+    def add(self, job_post_ids: list, text_hashes: list, vectors) -> None:
+        """ Insert or replace the (N, 3, D) vectors of the given job posts. """
+        if not job_post_ids:
+            return
+
+        normalized = F.normalize(vectors.float().cpu(), dim=-1)
+        with self.lock:
+            for job_post_id, text_hash, job_vectors in zip(job_post_ids, text_hashes, normalized):
+                position = self.positions.get(job_post_id)
+                if position is None and self.size >= self.max_size:
+                    position = self.next_eviction
+                    self.next_eviction = (position + 1) % self.max_size
+                    del self.positions[self.job_post_ids[position]]
+                    self.job_post_ids[position] = job_post_id
+                    self.positions[job_post_id] = position
+                elif position is None:
+                    if self.vectors is None or self.size == len(self.vectors):
+                        self.grow(min(max(1024, self.size * 2), self.max_size), job_vectors.shape[-1])
+                    position = self.size
+                    self.positions[job_post_id] = position
+                    self.job_post_ids.append(job_post_id)
+                    self.text_hashes.append(text_hash)
+                    self.size += 1
+                self.vectors[position] = job_vectors
+                self.text_hashes[position] = text_hash
+
+    def get(self, job_post_id: str, text_hash: str):
+        """ (3, D) vectors of a job post, None if missing or indexed for a different text. """
+        with self.lock:
+            position = self.positions.get(job_post_id)
+            if position is None or self.text_hashes[position] != text_hash:
+                return None
+            return self.vectors[position].clone()
+
+    def search(self, cv_vectors: dict, k: int, exclude: set = frozenset()) -> list:
+        """ Ids of the k job posts closest to the CV by weighted role, location and skills similarity. """
+        with self.lock:
+            if self.size == 0:
+                return []
+
+            query = F.normalize(torch.stack([cv_vectors['role'], cv_vectors['location'], cv_vectors['skills']]).float().cpu(), dim=-1)
+            similarities = torch.einsum("ncd,cd->nc", self.vectors[:self.size], query) @ RETRIEVAL_WEIGHTS
+            for job_post_id in exclude:
+                position = self.positions.get(job_post_id)
+                if position is not None:
+                    similarities[position] = float("-inf")
+
+            top = torch.topk(similarities, min(k, self.size))
+            return [
+                self.job_post_ids[position]
+                for score, position in zip(top.values.tolist(), top.indices.tolist())
+                if score != float("-inf")
+            ]
+
+job_index = JobVectorIndex()
+job_index_loaded = False
+job_index_lock = asyncio.Lock()
+
+async def load_job_index() -> None:
+    """ Fill the index with every stored embedding, page by page. Runs once, later vectors
+    are added by get_job_vectors as jobs are scored. """
+    global job_index_loaded
+    async with job_index_lock:
+        if job_index_loaded:
+            return
+
+        offset = 0
+        while True:
+            rows = await get_job_embeddings_page(offset, JOB_INDEX_PAGE_SIZE)
+            if rows:
+                job_index.add(
+                    [row["job_post_id"] for row in rows],
+                    [row["text_hash"] for row in rows],
+                    torch.tensor([[row["role_embedding"], row["location_embedding"], row["skills_embedding"]] for row in rows]),
+                )
+            if len(rows) < JOB_INDEX_PAGE_SIZE:
+                break
+            offset += JOB_INDEX_PAGE_SIZE
+
+        job_index_loaded = True
+        print(f"Job index loaded with {len(job_index)} jobs")
+
+async def find_stored_jobs(cv_vectors: dict, k: int = LOCAL_SEARCH_TOP_K, exclude_job_post_ids: set = frozenset()) -> list:
+    """ The k stored job posts closest to the CV, as job_posts rows ordered by similarity. """
+    if not JOB_INDEX_ENABLED:
+        return []
+
+    await load_job_index()
+    # Scansione CPU-bound, fuori dall'event loop come lo scoring
+    job_post_ids = await run_in_cpu_executor(job_index.search, cv_vectors, k, set(exclude_job_post_ids))
+    rows = await get_job_posts_by_ids(job_post_ids)
+    return [rows[job_post_id] for job_post_id in job_post_ids if job_post_id in rows]
@@ -0,0 +1,311 @@
+import os
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from typing import AsyncIterator
+from api.models.models import JobSearchRequest, SearchProgress, JobMatch, SearchCompleted, CreditReservation, RescoreCompleted
+from api.functions.fetch_jobs import fetch_jobs_from_api
+from api.functions.ingestion import save_job_posts, iter_saved_job_posts
+from api.functions.match_score import calculate_match_scores_batch, preprocess_cv
+from api.functions.supabase import (
+    delete_job_report, create_report_post_associations_batch, save_match_scores_batch,
+    save_job_report, get_job_report, get_report_job_post_ids, get_job_posts_by_ids,
+)
+from api.functions.credits import refund_credit
+from api.functions.metrics import request_timings, record_stage, track_stage
+from api.functions.job_index import find_stored_jobs
+
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "2"))
+SEARCH_QUEUE_SIZE = int(os.getenv("SEARCH_QUEUE_SIZE", "100"))
+SEARCH_PROGRESS_TTL = timedelta(seconds=int(os.getenv("SEARCH_PROGRESS_TTL", "3600")))
+
+search_queue: asyncio.Queue | None = None
+search_workers: list = []
+search_progress: dict = {}
+
+def update_search_progress(progress: SearchProgress, **fields) -> None:
+    for field, value in fields.items():
+        setattr(progress, field, value)
+    progress.updated_at = datetime.now().isoformat()
+
+def get_search_progress(job_report_id: str) -> SearchProgress | None:
+    return search_progress.get(job_report_id)
+
+def get_search_queue_stats() -> dict:
+    """ Queued searches and tracked searches by status. """
+    stats = {"queue_size": search_queue.qsize() if search_queue else 0}
+    for progress in search_progress.values():
+        stats[progress.status] = stats.get(progress.status, 0) + 1
+    return stats
+
+def prune_search_progress() -> None:
+    """ Forget finished searches older than SEARCH_PROGRESS_TTL. """
+    expires_before = (datetime.now() - SEARCH_PROGRESS_TTL).isoformat()
+    for job_report_id, progress in list(search_progress.items()):
+        if progress.status in ("completed", "failed") and progress.updated_at < expires_before:
+            del search_progress[job_report_id]
+
+def no_jobs_error(ingestion_errors: list) -> HTTPException:
+    """ Error of a search that ended without jobs: a 503 if it is because some jobs could not
+    be stored (e.g. requirement extraction failed), a 404 if JSearch found nothing. """
+    if ingestion_errors:
+        return HTTPException(status_code=503, detail=f"Requirement extraction failed: {str(ingestion_errors[0])}")
+    return HTTPException(status_code=404, detail="No jobs found for the given role and location")
+
+def remaining_credits(reservation: CreditReservation) -> int | None:
+    return reservation.credits if reservation.plan == "free" else None
+
+async def run_job_search(job_report_id: str, request: JobSearchRequest, reservation: CreditReservation) -> None:
+    """ Run the whole search pipeline for a report, recording per-stage progress and timings.
+    The credit was reserved when the search was queued: on failure the empty report is
+    deleted and the credit refunded. """
+    progress = search_progress[job_report_id]
+
+    def on_job_built(job_post) -> None:
+        update_search_progress(progress, requirements_extracted=progress.requirements_extracted + 1)
+
+    with request_timings() as timings:
+        record_stage("queue_wait", (datetime.now() - datetime.fromisoformat(progress.created_at)).total_seconds())
+        try:
+            with track_stage("search"):
+                await execute_job_search(job_report_id, request, progress, on_job_built)
+            update_search_progress(progress, status="completed", credits_remaining=remaining_credits(reservation))
+
+        except (Exception, asyncio.CancelledError) as e:
+            # Un CancelledError propagato dalla pipeline (es. una chiamata condivisa annullata) fa
+            # fallire solo questa ricerca; se invece è il worker a fermarsi, si rilancia
+            shutting_down = isinstance(e, asyncio.CancelledError) and asyncio.current_task().cancelling() > 0
+            print(f"Error in job search: {str(e) or type(e).__name__}")
+            error = e.detail if isinstance(e, HTTPException) else str(e) or "Search cancelled"
+            update_search_progress(progress, status="failed", error=error)
+            if shutting_down:
+                raise
+            await refund_credit(request.user_id, reservation)
+            try:
+                await delete_job_report(job_report_id)
+            except Exception as e:
+                print(f"Error deleting failed job report: {str(e)}")
+
+        finally:
+            timings.observe_calls()
+            update_search_progress(progress, timings=timings.stage_ms(), calls=dict(timings.calls))
+
+async def fetch_search_jobs(request: JobSearchRequest) -> list:
+    """ JSearch results for a search. In local_first mode a JSearch failure is not fatal,
+    the search goes on with the stored jobs only. """
+    try:
+        return await fetch_jobs_from_api(request.role, request.location)
+    except Exception as e:
+        if request.search_mode != "local_first":
+            raise
+        print(f"Error fetching jobs, using stored jobs only: {str(e)}")
+        return []
+
+async def execute_job_search(job_report_id: str, request: JobSearchRequest, progress: SearchProgress, on_job_built) -> None:
+    update_search_progress(progress, status="fetching_jobs")
+    jobs = await fetch_search_jobs(request)
+    update_search_progress(progress, jobs_fetched=len(jobs))
+
+    if not jobs and request.search_mode != "local_first":
+        raise HTTPException(status_code=404, detail="No jobs found for the given role and location")
+
+    # Pre-process CV data once, while the jobs are saved concurrently
+    update_search_progress(progress, status="saving_jobs")
+    ingestion_errors = []
+    cv_vectors, saved_jobs = await asyncio.gather(
+        preprocess_cv(request),
+        save_job_posts(jobs, on_job_built=on_job_built, on_batch_failed=ingestion_errors.append),
+    )
+    update_search_progress(progress, jobs_saved=len(saved_jobs))
+
+    if request.search_mode == "local_first":
+        with track_stage("local_search"):
+            local_jobs = await find_stored_jobs(cv_vectors, exclude_job_post_ids={saved_job["id"] for saved_job in saved_jobs})
+        saved_jobs = saved_jobs + local_jobs
+        update_search_progress(progress, local_jobs=len(local_jobs))
+
+    if not saved_jobs:
+        raise no_jobs_error(ingestion_errors)
+
+    # Calculate all match scores in batch
+    update_search_progress(progress, status="scoring")
+    match_scores = await calculate_match_scores_batch(cv_vectors, saved_jobs)
+    update_search_progress(progress, scores_calculated=len(match_scores))
+
+    # Save all match scores and create associations in bulk
+    update_search_progress(progress, status="saving_scores")
+    job_post_ids = [saved_job["id"] for saved_job in saved_jobs]
+    with track_stage("save_scores"):
+        match_score_ids = await save_match_scores_batch(request.user_id, job_report_id, job_post_ids, match_scores)
+        await create_report_post_associations_batch(job_report_id, job_post_ids)
+    update_search_progress(progress, scores_saved=len(match_score_ids))
+
+async def cleanup_failed_search(job_report_id: str, user_id: str, reservation: CreditReservation) -> None:
+    await refund_credit(user_id, reservation)
+    await delete_job_report(job_report_id)
+
+def build_job_match(saved_job: dict, match_score: int) -> JobMatch:
+    return JobMatch(
+        job_post_id=saved_job["id"],
+        job_id=saved_job["job_id"],
+        company=saved_job.get("company"),
+        role=saved_job.get("role"),
+        location=saved_job.get("location"),
+        years_experience=saved_job.get("years_experience"),
+        requirements=saved_job.get("requirements") or [],
+        url=saved_job.get("url"),
+        salary=saved_job.get("salary"),
+        match_score=match_score,
+    )
+
+async def rescore_job_report(source_job_report_id: str, request: JobSearchRequest) -> RescoreCompleted:
+    """ Score the jobs of an existing report against a new CV profile and store them as a new report
+    with the role and location of the original search.
+    Jobs are read from job_report_posts and scored with their stored (or indexed) embeddings:
+    no JSearch or LLM call and no credit, only the CV is encoded. """
+    try:
+        uuid.UUID(source_job_report_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Job report not found")
+
+    source_report, job_post_ids = await asyncio.gather(
+        get_job_report(source_job_report_id),
+        get_report_job_post_ids(source_job_report_id),
+    )
+    # Un report di un altro utente risponde come uno inesistente
+    if source_report is None or source_report["user_id"] != request.user_id:
+        raise HTTPException(status_code=404, detail="Job report not found")
+
+    # Ruolo e location restano quelli della ricerca che ha trovato i job, dal CV aggiornato
+    # si prendono solo skills, esperienza e nome del file
+    request = request.model_copy(update={"role": source_report["role"], "location": source_report["location"]})
+
+    cv_vectors, job_posts = await asyncio.gather(preprocess_cv(request), get_job_posts_by_ids(job_post_ids))
+    saved_jobs = [job_posts[job_post_id] for job_post_id in job_post_ids if job_post_id in job_posts]
+    if not saved_jobs:
+        raise HTTPException(status_code=404, detail="The job report has no job posts")
+
+    match_scores = await calculate_match_scores_batch(cv_vectors, saved_jobs)
+
+    job_report_id = await save_job_report(request)
+    try:
+        job_post_ids = [saved_job["id"] for saved_job in saved_jobs]
+        with track_stage("save_scores"):
+            await asyncio.gather(
+                save_match_scores_batch(request.user_id, job_report_id, job_post_ids, match_scores),
+                create_report_post_associations_batch(job_report_id, job_post_ids),
+            )
+    except Exception:
+        await delete_job_report(job_report_id)
+        raise
+
+    jobs = [build_job_match(saved_job, match_score) for saved_job, match_score in zip(saved_jobs, match_scores)]
+    jobs.sort(key=lambda job: job.match_score, reverse=True)
+    return RescoreCompleted(job_report_id=job_report_id, source_job_report_id=source_job_report_id, jobs=jobs)
+
+async def stream_job_search(job_report_id: str, request: JobSearchRequest, reservation: CreditReservation) -> AsyncIterator[tuple]:
+    """ Run the search pipeline yielding ("job", JobMatch) events as soon as each batch of jobs
+    is saved and scored, then a final ("done", SearchCompleted) event once scores are stored.
+    In local_first mode the closest stored jobs come first.
+    On failure yields ("error", detail), deletes the report and refunds the reserved credit,
+    which also happens if the client goes away before the end. """
+    # Il CV viene codificato mentre si interroga JSearch
+    cv_task = asyncio.ensure_future(preprocess_cv(request))
+    jobs_task = asyncio.ensure_future(fetch_search_jobs(request))
+    for task in (cv_task, jobs_task):
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    job_post_ids, match_scores, ingestion_errors = [], [], []
+    emitted = set()
+
+    async def score_jobs(saved_jobs: list) -> list:
+        # Un job già emesso (es. trovato sia in locale che su JSearch) non va ripetuto
+        saved_jobs = [saved_job for saved_job in saved_jobs if saved_job["id"] not in emitted]
+        scores = await calculate_match_scores_batch(cv_vectors, saved_jobs)
+        emitted.update(saved_job["id"] for saved_job in saved_jobs)
+        job_post_ids.extend(saved_job["id"] for saved_job in saved_jobs)
+        match_scores.extend(scores)
+        return [build_job_match(saved_job, match_score) for saved_job, match_score in zip(saved_jobs, scores)]
+
+    completed = False
+    try:
+        cv_vectors = await cv_task
+
+        if request.search_mode == "local_first":
+            with track_stage("local_search"):
+                local_jobs = await find_stored_jobs(cv_vectors)
+            for job_match in await score_jobs(local_jobs):
+                yield "job", job_match
+
+        jobs = await jobs_task
+        if not jobs and not job_post_ids:
+            raise HTTPException(status_code=404, detail="No jobs found for the given role and location")
+
+        async for saved_jobs in iter_saved_job_posts(jobs, on_batch_failed=ingestion_errors.append):
+            for job_match in await score_jobs(saved_jobs):
+                yield "job", job_match
+
+        # Come in /search: se nessun job è stato salvato la ricerca fallisce e il credito torna indietro
+        if not job_post_ids:
+            raise no_jobs_error(ingestion_errors)
+
+        with track_stage("save_scores"):
+            await save_match_scores_batch(request.user_id, job_report_id, job_post_ids, match_scores)
+            await create_report_post_associations_batch(job_report_id, job_post_ids)
+
+        completed = True
+        yield "done", SearchCompleted(job_report_id=job_report_id, jobs=len(job_post_ids), credits_remaining=remaining_credits(reservation))
+
+    except Exception as e:
+        print(f"Error in streaming job search: {str(e)}")
+        yield "error", e.detail if isinstance(e, HTTPException) else str(e)
+
+    finally:
+        cv_task.cancel()
+        jobs_task.cancel()
+        if not completed:
+            # shield: se il client si è disconnesso lo stream viene cancellato, la pulizia deve finire comunque
+            try:
+                await asyncio.shield(asyncio.ensure_future(cleanup_failed_search(job_report_id, request.user_id, reservation)))
+            except Exception as e:
+                print(f"Error deleting failed job report: {str(e)}")
+
+async def search_worker() -> None:
+    while True:
+        job_report_id, request, reservation = await search_queue.get()
+        try:
+            await run_job_search(job_report_id, request, reservation)
+        except Exception as e:
+            # Il worker non deve morire per una singola ricerca
+            print(f"Error in search worker: {str(e)}")
+        finally:
+            search_queue.task_done()
+
+def start_search_workers(workers: int = SEARCH_WORKERS) -> None:
+    global search_queue
+    search_queue = asyncio.Queue(maxsize=SEARCH_QUEUE_SIZE)
+    for _ in range(workers):
+        search_workers.append(asyncio.create_task(search_worker()))
+
+async def stop_search_workers() -> None:
+    for worker in search_workers:
+        worker.cancel()
+    await asyncio.gather(*search_workers, return_exceptions=True)
+    search_workers.clear()
+
+def enqueue_job_search(job_report_id: str, request: JobSearchRequest, reservation: CreditReservation) -> SearchProgress:
+    """ Queue a search for the background workers and return its progress record. """
+    prune_search_progress()
+
+    now = datetime.now().isoformat()
+    progress = SearchProgress(job_report_id=job_report_id, created_at=now, updated_at=now)
+    search_progress[job_report_id] = progress
+
+    try:
+        search_queue.put_nowait((job_report_id, request, reservation))
+    except asyncio.QueueFull:
+        del search_progress[job_report_id]
+        raise HTTPException(status_code=503, detail="Too many searches in progress, please try again later")
+
+    return progress
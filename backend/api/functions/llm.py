@@ -0,0 +1,153 @@
+import os
+import time
+import json
+import random
+import asyncio
+import openai
+from openai import AsyncOpenAI
+from api.functions.metrics import record_stage, record_call, llm_tokens, llm_retries
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "0.5"))
+LLM_MAX_BACKOFF_SECONDS = float(os.getenv("LLM_MAX_BACKOFF_SECONDS", "20"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+# Token riservati per la risposta quando la chiamata non indica max_tokens
+LLM_DEFAULT_COMPLETION_TOKENS = int(os.getenv("LLM_DEFAULT_COMPLETION_TOKENS", "500"))
+
+# Stima grossolana per i modelli GPT: ~4 caratteri per token
+CHARS_PER_TOKEN = 4
+
+class LLMError(Exception):
+    """ An LLM call that failed after retries, or returned an unusable response. """
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """ Cut text to roughly max_tokens tokens, at the last whitespace before the limit. """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[:cut if cut > max_chars // 2 else max_chars]
+
+class TokenBucket:
+    """ Async token bucket refilled continuously at capacity per minute.
+    Waiters are served in arrival order; a charge larger than the capacity waits for a full bucket. """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.available = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    async def acquire(self, amount: int) -> None:
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self.refill()
+            while self.available < amount:
+                await asyncio.sleep((amount - self.available) * 60 / self.capacity)
+                self.refill()
+            self.available -= amount
+
+    def adjust(self, amount: int) -> None:
+        """ Correct a previous charge once the real usage is known (negative gives tokens back). """
+        self.refill()
+        self.available = min(self.capacity, self.available - amount)
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """ Retry-After when the server sends it, otherwise exponential backoff with full jitter. """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_MAX_BACKOFF_SECONDS)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_MAX_BACKOFF_SECONDS, LLM_BACKOFF_SECONDS * 2 ** attempt))
+
+class LLMClient:
+    """ AsyncOpenAI wrapper shared by all LLM calls: caps concurrent requests, keeps under the
+    requests and tokens per minute limits and retries rate limits, timeouts and 5xx with backoff. """
+
+    def __init__(self):
+        # I retry li gestisce il wrapper, così le attese rispettano i limiti condivisi
+        self.client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL"),
+            timeout=LLM_TIMEOUT_SECONDS,
+            max_retries=0,
+        )
+        self.semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self.requests = TokenBucket(LLM_REQUESTS_PER_MINUTE)
+        self.tokens = TokenBucket(LLM_TOKENS_PER_MINUTE)
+
+    async def complete_json(self, name: str, system: str, prompt: str, max_tokens: int | None = None):
+        """ Run a JSON-mode chat completion and return the parsed content.
+        Every attempt is recorded as an external call named name, e.g. "cv_summary",
+        together with its token usage. Raises LLMError. """
+        estimated_tokens = estimate_tokens(system) + estimate_tokens(prompt) + (max_tokens or LLM_DEFAULT_COMPLETION_TOKENS)
+
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            start = time.perf_counter()
+            async with self.semaphore:
+                await self.requests.acquire(1)
+                await self.tokens.acquire(estimated_tokens)
+                record_stage("llm_wait", time.perf_counter() - start)
+                start = time.perf_counter()
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=LLM_MODEL,
+                        messages=[{"role": "system", "content": system},
+                                  {"role": "user", "content": prompt}],
+                        temperature=0.1,
+                        response_format={"type": "json_object"},
+                        **({"max_tokens": max_tokens} if max_tokens else {}),
+                    )
+                except Exception as e:
+                    retry = is_retryable(e) and attempt < LLM_MAX_RETRIES
+                    record_call("llm", name, time.perf_counter() - start, "retry" if retry else "error")
+                    if not retry:
+                        raise LLMError(f"{name} failed: {str(e)}") from e
+                    error = e
+                else:
+                    record_call("llm", name, time.perf_counter() - start, "ok")
+                    error = None
+
+            if error is not None:
+                llm_retries.inc(name, type(error).__name__)
+                await asyncio.sleep(retry_delay(error, attempt))
+                continue
+
+            if response.usage:
+                self.tokens.adjust(response.usage.total_tokens - estimated_tokens)
+                llm_tokens.inc(name, "prompt", amount=response.usage.prompt_tokens)
+                llm_tokens.inc(name, "completion", amount=response.usage.completion_tokens)
+
+            try:
+                return json.loads(response.choices[0].message.content)
+            except (TypeError, ValueError) as e:
+                raise LLMError(f"{name} returned invalid JSON: {str(e)}") from e
+
+llm_client: LLMClient | None = None
+
+def get_llm_client() -> LLMClient:
+    """ LLM client, created on first use. """
+    global llm_client
+    if llm_client is None:
+        llm_client = LLMClient()
+    return llm_client
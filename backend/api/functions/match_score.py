@@ -1,104 +1,295 @@
 import os
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import torch
 import torch.nn.functional as F
-from sentence_transformers import SentenceTransformer
-from api.models.models import JobSearchRequest
-from huggingface_hub import login
+from api.models.models import JobSearchRequest, JobEmbedding
+from api.functions.supabase import get_job_embeddings, save_job_embeddings
+from api.functions.executor import run_in_cpu_executor
+from api.functions.embedding_service import EmbeddingBatcher, EMBEDDING_MAX_BATCH_SIZE
+from api.functions.metrics import timed_stage
+from api.functions.job_index import job_index, JOB_INDEX_ENABLED
 
-# Login to Hugging Face
-if os.getenv("HUGGINGFACE_TOKEN"):
-    login(os.getenv("HUGGINGFACE_TOKEN"))
+MODEL_NAME = "all-mpnet-base-v2"
+EMBEDDING_DIMENSION = 768
+MAX_TEXT_LENGTH = 128
 
-model = SentenceTransformer("all-mpnet-base-v2")
+# Backend di inferenza: "torch" (fp32), "onnx" (ONNX Runtime) o "onnx-int8" (ONNX quantizzato dinamicamente)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model.onnx")
+EMBEDDING_ONNX_INT8_FILE = os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+EMBEDDING_BACKENDS = ["torch", "onnx", "onnx-int8"]
 
-def encode_texts(texts, max_length=128):
+model = None
+model_lock = threading.Lock()
+
+def load_model(backend: str = EMBEDDING_BACKEND):
+    """ Load the sentence transformer with the given inference backend.
+    The ONNX backends need optimum[onnxruntime] and use the exports shipped in the model repo. """
+    from huggingface_hub import login
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    # Login to Hugging Face
+    if os.getenv("HUGGINGFACE_TOKEN"):
+        login(os.getenv("HUGGINGFACE_TOKEN"))
+
+    if backend == "torch":
+        return SentenceTransformer(MODEL_NAME)
+
+    file_name = EMBEDDING_ONNX_INT8_FILE if backend == "onnx-int8" else EMBEDDING_ONNX_FILE
+    return SentenceTransformer(
+        MODEL_NAME,
+        backend="onnx",
+        model_kwargs={"file_name": file_name, "provider": "CPUExecutionProvider"},
+    )
+
+def get_model():
+    """ Load the model on first use, so importing the app and requests that never
+    embed (e.g. /summarize) do not wait for it. """
+    global model
+    with model_lock:
+        if model is None:
+            model = load_model(EMBEDDING_BACKEND)
+    return model
+
+def is_model_loaded() -> bool:
+    return model is not None
+
+PREWARM_MODEL = os.getenv("PREWARM_MODEL", "true").lower() == "true"
+
+# Il modello è usato solo dal thread del batcher, che unisce le richieste concorrenti in micro-batch
+embedding_batcher = EmbeddingBatcher(
+    lambda texts: get_model().encode(texts, convert_to_tensor=True, batch_size=EMBEDDING_MAX_BATCH_SIZE).cpu()
+)
+
+def prewarm_model() -> None:
+    """ Load the model and run a first encode on the batcher thread, meant to run in the
+    background after startup. """
+    embedding_batcher.submit(["warmup"]).result()
+
+# Cache LRU degli embedding dei testi brevi (ruoli, location, skills ricorrenti)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+embedding_cache = OrderedDict()
+embedding_cache_lock = threading.Lock()
+embedding_cache_stats = {"hits": 0, "misses": 0}
+
+def get_embedding_cache_stats() -> dict:
+    """ Hit and miss counters of the encode_texts cache. """
+    with embedding_cache_lock:
+        lookups = embedding_cache_stats["hits"] + embedding_cache_stats["misses"]
+        return {
+            **embedding_cache_stats,
+            "size": len(embedding_cache),
+            "max_size": EMBEDDING_CACHE_SIZE,
+            "hit_rate": embedding_cache_stats["hits"] / lookups if lookups else 0.0,
+        }
+
+@timed_stage("encode")
+async def encode_texts(texts, max_length=MAX_TEXT_LENGTH):
     """ Encode multiple texts in batch to improve performance. 
-    Limit text length to reduce processing time. """
+    Limit text length to reduce processing time.
+    Texts already seen are served from an LRU cache, only the misses are sent to
+    the embedding batcher, together with the misses of concurrent requests. """
     truncated_texts = [text[:max_length] for text in texts]
-    return model.encode(truncated_texts, convert_to_tensor=True, batch_size=len(truncated_texts))
+    if not truncated_texts:
+        return torch.empty(0, EMBEDDING_DIMENSION)
 
-def calculate_match_scores_batch(cv_vectors: dict, jobs: list) -> list:
-    """Calculate match scores for multiple jobs in batch"""
-    try:
-        # Prepara tutti i testi dei job in batch
-        all_job_texts = []
-        for job in jobs:
-            job_texts = [
-                f"Role: {job['role'].lower()}",
-                f"Location: {job['location'].lower()}",
-                f"Skills: {' '.join(job.get('requirements', [])).lower()}"
-            ]
-            all_job_texts.extend(job_texts)
-        
-        # Encoding di tutti i job in un'unica chiamata
-        all_job_vectors = encode_texts(all_job_texts)
-        
-        match_scores = []
-        # Processa i risultati per ogni job
-        for i in range(0, len(all_job_vectors), 3):
-            job = jobs[i // 3]
-            job_role_vector = all_job_vectors[i]
-            job_location_vector = all_job_vectors[i + 1]
-            job_skills_vector = all_job_vectors[i + 2]
-            
-            # Calcola similarità
-            role_similarity = float(F.cosine_similarity(cv_vectors['role'], job_role_vector, dim=0))
-            location_similarity = float(F.cosine_similarity(cv_vectors['location'], job_location_vector, dim=0))
-            skills_similarity = float(F.cosine_similarity(cv_vectors['skills'], job_skills_vector, dim=0))
-
-            # Calcola similarità esperienza
-            if job.get("years_experience") is not None and cv_vectors['years_experience'] is not None:
-                experience_diff = abs(cv_vectors['years_experience'] - job["years_experience"])
-                experience_similarity = max(0, 1 - (experience_diff / 10))
+    vectors = {}
+    with embedding_cache_lock:
+        for text in truncated_texts:
+            vector = embedding_cache.get(text)
+            if vector is not None:
+                embedding_cache.move_to_end(text)
+                vectors[text] = vector
+                embedding_cache_stats["hits"] += 1
             else:
-                experience_similarity = 0
-
-            # Pesi
-            role_weight = 0.25 if job.get("years_experience") is not None else 0.30
-            skills_weight = 0.50
-            location_weight = 0.15 if job.get("years_experience") is not None else 0.20
-            experience_weight = 0.10 if job.get("years_experience") is not None else 0
-
-            # Calcola similarità pesata
-            weighted_similarity = (
-                (role_similarity * role_weight) +
-                (skills_similarity * skills_weight) +
-                (location_similarity * location_weight) +
-                (experience_similarity * experience_weight)
+                embedding_cache_stats["misses"] += 1
+
+    missing_texts = list(dict.fromkeys(text for text in truncated_texts if text not in vectors))
+    if missing_texts:
+        encoded = await asyncio.wrap_future(embedding_batcher.submit(missing_texts))
+        with embedding_cache_lock:
+            for text, vector in zip(missing_texts, encoded):
+                # clone so a cached row does not keep the whole batch tensor alive
+                vectors[text] = vector.clone()
+                if EMBEDDING_CACHE_SIZE > 0:
+                    embedding_cache[text] = vectors[text]
+                    embedding_cache.move_to_end(text)
+            while len(embedding_cache) > EMBEDDING_CACHE_SIZE:
+                embedding_cache.popitem(last=False)
+
+    return torch.stack([vectors[text] for text in truncated_texts])
+
+def build_job_texts(job: dict) -> list:
+    """ Role, location and skills texts embedded for a job. """
+    return [
+        f"Role: {job['role'].lower()}",
+        f"Location: {job['location'].lower()}",
+        f"Skills: {' '.join(job.get('requirements') or []).lower()}"
+    ]
+
+def hash_job_texts(job_texts: list) -> str:
+    """ Content hash of the texts actually encoded, including the model and backend that
+    encode them, so vectors stored by a different backend are treated as stale. """
+    model_version = MODEL_NAME if EMBEDDING_BACKEND == "torch" else f"{MODEL_NAME}:{EMBEDDING_BACKEND}"
+    content = "\n".join([model_version] + [text[:MAX_TEXT_LENGTH] for text in job_texts])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+async def get_job_vectors(jobs: list):
+    """ Return the (N, 3, D) role, location and skills vectors of saved jobs.
+    Vectors come from the in-process job index or the embedding store, only jobs that are
+    missing or whose text changed since they were stored are encoded, and their new
+    vectors are persisted and indexed. """
+    if not jobs:
+        return torch.empty(0, 3, EMBEDDING_DIMENSION)
+
+    all_job_texts = [build_job_texts(job) for job in jobs]
+    text_hashes = [hash_job_texts(job_texts) for job_texts in all_job_texts]
+
+    job_vectors = [None] * len(jobs)
+    if JOB_INDEX_ENABLED:
+        for i, job in enumerate(jobs):
+            job_vectors[i] = job_index.get(job["id"], text_hashes[i])
+
+    not_indexed = [i for i, vectors in enumerate(job_vectors) if vectors is None]
+    try:
+        stored_embeddings = await get_job_embeddings([jobs[i]["id"] for i in not_indexed])
+    except Exception as e:
+        print(f"Error loading job embeddings: {str(e)}")
+        stored_embeddings = {}
+
+    missing = []
+    loaded = []
+    for i in not_indexed:
+        stored = stored_embeddings.get(jobs[i]["id"])
+        if stored and stored["text_hash"] == text_hashes[i]:
+            job_vectors[i] = torch.tensor(
+                [stored["role_embedding"], stored["location_embedding"], stored["skills_embedding"]],
+                dtype=torch.float32,
             )
+            loaded.append(i)
+        else:
+            missing.append(i)
 
-            # Boost per match alti
-            if weighted_similarity >= 0.7:
-                boosted_similarity = 0.75 + (weighted_similarity - 0.7) * (0.98 - 0.75) / 0.3
-                match_score = round(boosted_similarity * 100)
-            else:
-                match_score = round(weighted_similarity * 100)
+    if missing:
+        # Encoding di tutti i job mancanti in un'unica chiamata
+        encoded = await encode_texts([text for i in missing for text in all_job_texts[i]])
+        encoded = encoded.reshape(len(missing), 3, -1)
+
+        new_embeddings = []
+        updated_at = datetime.now().isoformat()
+        for vectors, i in zip(encoded, missing):
+            job_vectors[i] = vectors
+            role_vector, location_vector, skills_vector = vectors.cpu().tolist()
+            new_embeddings.append(JobEmbedding(
+                job_post_id=jobs[i]["id"],
+                text_hash=text_hashes[i],
+                role_embedding=role_vector,
+                location_embedding=location_vector,
+                skills_embedding=skills_vector,
+                updated_at=updated_at,
+            ))
+
+        try:
+            await save_job_embeddings(new_embeddings)
+        except Exception as e:
+            print(f"Error saving job embeddings: {str(e)}")
+
+    # Aggiorna l'indice con i vettori letti dallo store o appena calcolati
+    indexed = loaded + missing
+    if JOB_INDEX_ENABLED and indexed:
+        job_index.add([jobs[i]["id"] for i in indexed], [text_hashes[i] for i in indexed], torch.stack([job_vectors[i] for i in indexed]))
+
+    return torch.stack(job_vectors)
+
+def score_job_vectors(cv_vectors: dict, job_vectors, jobs_years_experience: list) -> list:
+    """ Score a (N, 3, D) tensor of job role, location and skills vectors against the CV
+    with batched tensor operations. Gives the same integer scores as scoring job by job. """
+    if len(jobs_years_experience) == 0:
+        return []
+
+    cv_matrix = torch.stack([cv_vectors['role'], cv_vectors['location'], cv_vectors['skills']]).to(job_vectors.device)
 
-            match_scores.append(min(100, max(0, match_score)))
+    # Similarità coseno di ruolo, location e skills per tutti i job: (N, 3)
+    similarities = F.cosine_similarity(job_vectors, cv_matrix.unsqueeze(0), dim=-1).double().cpu()
+    role_similarity, location_similarity, skills_similarity = similarities.unbind(dim=1)
 
-        return match_scores
+    # Calcola similarità esperienza, solo per i job con anni di esperienza
+    has_experience = torch.tensor([years is not None for years in jobs_years_experience])
+    job_experience = torch.tensor([years or 0 for years in jobs_years_experience], dtype=torch.float64)
+    if cv_vectors['years_experience'] is not None:
+        experience_diff = (cv_vectors['years_experience'] - job_experience).abs()
+        experience_similarity = (1 - (experience_diff / 10)).clamp(min=0)
+        experience_similarity = torch.where(has_experience, experience_similarity, 0.0)
+    else:
+        experience_similarity = torch.zeros_like(job_experience)
+
+    # Pesi
+    role_weight = torch.where(has_experience, 0.25, 0.30).double()
+    skills_weight = 0.50
+    location_weight = torch.where(has_experience, 0.15, 0.20).double()
+    experience_weight = torch.where(has_experience, 0.10, 0.0).double()
+
+    # Calcola similarità pesata
+    weighted_similarity = (
+        (role_similarity * role_weight) +
+        (skills_similarity * skills_weight) +
+        (location_similarity * location_weight) +
+        (experience_similarity * experience_weight)
+    )
+
+    # Boost per match alti
+    boosted_similarity = torch.where(
+        weighted_similarity >= 0.7,
+        0.75 + (weighted_similarity - 0.7) * (0.98 - 0.75) / 0.3,
+        weighted_similarity,
+    )
+    match_scores = torch.round(boosted_similarity * 100).clamp(0, 100)
+
+    return [int(match_score) for match_score in match_scores.tolist()]
+
+@timed_stage("scoring")
+async def calculate_match_scores_batch(cv_vectors: dict, jobs: list) -> list:
+    """Calculate match scores for multiple jobs in batch"""
+    try:
+        # Vettori dei job dallo store, codificando solo quelli mancanti
+        job_vectors = await get_job_vectors(jobs)
+
+        return await run_in_cpu_executor(score_job_vectors, cv_vectors, job_vectors, [job.get("years_experience") for job in jobs])
 
     except Exception as e:
         print(f"Error calculating batch match scores: {str(e)}")
         return [50] * len(jobs)
 
-def calculate_match_score(cv_vectors: dict, saved_job: dict) -> int:
+async def calculate_match_score(cv_vectors: dict, saved_job: dict) -> int:
     """Wrapper for single job match score calculation"""
     try:
-        scores = calculate_match_scores_batch(cv_vectors, [saved_job])
+        scores = await calculate_match_scores_batch(cv_vectors, [saved_job])
         return scores[0]
     except Exception as e:
         print(f"Error calculating match score: {str(e)}")
         return 50
 
-def preprocess_cv(cv_data: JobSearchRequest) -> dict:
-    """ Pre-compute CV vectors to avoid redundant encoding. """
-    cv_texts = [
+def build_cv_texts(cv_data: JobSearchRequest) -> list:
+    """ Role, location and skills texts embedded for a CV. """
+    return [
         f"Role: {cv_data.role.lower()}",
         f"Location: {cv_data.location.lower()}",
         f"Skills: {' '.join(cv_data.skills).lower()}"
     ]
+
+@timed_stage("preprocess_cv")
+async def preprocess_cv(cv_data: JobSearchRequest) -> dict:
+    """ Pre-compute CV vectors to avoid redundant encoding. """
+    cv_texts = build_cv_texts(cv_data)
     
-    role_vector, location_vector, skills_vector = encode_texts(cv_texts)
+    role_vector, location_vector, skills_vector = await encode_texts(cv_texts)
 
     return {
         'role': role_vector,
@@ -0,0 +1,171 @@
+import time
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def format_labels(labelnames: tuple, labels: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] += amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> (conteggi per bucket, somma, conteggio)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, *labels, value: float) -> None:
+        with self.lock:
+            bucket_counts, total, count = self.values.get(labels, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+            self.values[labels] = (bucket_counts, total + value, count + 1)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (bucket_counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    bucket_labels = format_labels(self.labelnames, labels, 'le="%g"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+                bucket_labels = format_labels(self.labelnames, labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total:g}")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+stage_duration = Histogram("resumatcher_stage_duration_seconds", "Duration of the hot-path stages.", ("stage",))
+external_calls = Counter("resumatcher_external_calls_total", "Calls to external services (db, llm, jsearch).", ("kind", "name", "outcome"))
+external_call_duration = Histogram("resumatcher_external_call_duration_seconds", "Duration of calls to external services.", ("kind", "name"))
+llm_tokens = Counter("resumatcher_llm_tokens_total", "Tokens used by LLM calls.", ("name", "type"))
+llm_retries = Counter("resumatcher_llm_retries_total", "LLM attempts retried after a rate limit, timeout or server error.", ("name", "error"))
+request_duration = Histogram("resumatcher_http_request_duration_seconds", "Duration of HTTP requests.", ("method", "route", "status"))
+request_external_calls = Histogram(
+    "resumatcher_request_external_calls", "External calls made by a single request or search.", ("kind",),
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250),
+)
+
+class RequestTimings:
+    """ Stage durations and external call counts of one request (or one background search). """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.call_seconds = defaultdict(float)
+
+    def stage_ms(self) -> dict:
+        return {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+
+    def server_timing(self) -> str:
+        """ Value of the Server-Timing header: stages, then time and number of calls per service. """
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        entries += [f'{kind};desc="{count} calls";dur={self.call_seconds[kind] * 1000:.1f}' for kind, count in self.calls.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def observe_calls(self) -> None:
+        """ Record how many external calls this request made, once it is finished. """
+        for kind, count in self.calls.items():
+            request_external_calls.observe(kind, value=count)
+
+current_timings: ContextVar[RequestTimings | None] = ContextVar("current_timings", default=None)
+
+@contextmanager
+def request_timings():
+    """ Collect the timings of everything awaited inside the block, including tasks it spawns. """
+    timings = RequestTimings()
+    token = current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        current_timings.reset(token)
+
+def record_stage(stage: str, seconds: float) -> None:
+    stage_duration.observe(stage, value=seconds)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.stages[stage] += seconds
+
+@contextmanager
+def track_stage(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def timed_stage(stage: str):
+    """ Decorator recording every run of an async function as a stage. """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track_stage(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_call(kind: str, name: str, seconds: float, outcome: str) -> None:
+    external_calls.inc(kind, name, outcome)
+    external_call_duration.observe(kind, name, value=seconds)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.calls[kind] += 1
+        timings.call_seconds[kind] += seconds
+
+def instrumented(kind: str):
+    """ Decorator counting and timing an async call to an external service, e.g. kind="db". """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await func(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                record_call(kind, func.__name__, time.perf_counter() - start, outcome)
+        return wrapper
+    return decorator
+
+def observe_request(method: str, route: str, status: int, seconds: float) -> None:
+    request_duration.observe(method, route, str(status), value=seconds)
+
+def render_metrics(gauges: dict | None = None) -> str:
+    """ Prometheus text exposition of all metrics, plus gauges given as {name: (help, value)}. """
+    lines = []
+    for metric in (stage_duration, external_calls, external_call_duration, llm_tokens, llm_retries, request_duration, request_external_calls):
+        lines += metric.render()
+    for name, (documentation, value) in (gauges or {}).items():
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} gauge", f"{name} {value:g}"]
+    return "\n".join(lines) + "\n"
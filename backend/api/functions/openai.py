@@ -1,15 +1,19 @@
 import os
-from dotenv import load_dotenv
-from openai import OpenAI
 import json
-from api.models.models import CvSummary
-from typing import List
+import asyncio
+from api.models.models import CvSummary, JobRequirements
+from api.functions.llm import get_llm_client, truncate_to_tokens, LLMError
+from typing import List, Dict
 
-load_dotenv()
+# Budget in token dei testi inviati al modello, il resto viene troncato
+CV_TOKEN_BUDGET = int(os.getenv("CV_TOKEN_BUDGET", "6000"))
+JOB_DESCRIPTION_TOKEN_BUDGET = int(os.getenv("JOB_DESCRIPTION_TOKEN_BUDGET", "1500"))
+REQUIREMENTS_BATCH_SIZE = int(os.getenv("REQUIREMENTS_BATCH_SIZE", "5"))
+MAX_REQUIREMENTS = 8
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-def generate_summary_with_openai(cleaned_text: str) -> CvSummary:
+async def generate_summary_with_openai(cleaned_text: str) -> CvSummary:
+    """ Summarize a CV, truncated to CV_TOKEN_BUDGET tokens. Raises LLMError. """
+    cleaned_text = truncate_to_tokens(cleaned_text, CV_TOKEN_BUDGET)
     prompt = f"""Analyze the following CV and extract the key information in JSON format.
     
     Curriculum Vitae:
@@ -25,24 +29,16 @@ def generate_summary_with_openai(cleaned_text: str) -> CvSummary:
     
     Respond ONLY with JSON, without additional comments. If any information is missing, leave the field as an empty array or null."""
 
+    analysis_data = await get_llm_client().complete_json("cv_summary", "You are an expert assistant in CV analysis.", prompt)
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "system", "content": "You are an expert assistant in CV analysis."},
-                      {"role": "user", "content": prompt}],
-            temperature=0.1,
-            response_format={"type": "json_object"},
-        )
-        
-        result = response.choices[0].message.content
-        analysis_data = json.loads(result)
-
         return CvSummary.model_validate(analysis_data)
     except Exception as e:
-        print(f"Error in OpenAI API call: {e}")
-        return CvSummary(role="", experience_years=None, location=None, skills=[], education=[], summary="")
+        raise LLMError(f"Invalid CV summary: {str(e)}") from e
 
-def get_job_requirements(description: str) -> List[str]:
+async def get_job_requirements(description: str) -> List[str]:
+    """ Extract the requirements of one job description, truncated to JOB_DESCRIPTION_TOKEN_BUDGET
+    tokens. Raises LLMError if the call fails or no requirements can be read from the response. """
+    description = truncate_to_tokens(description, JOB_DESCRIPTION_TOKEN_BUDGET)
     prompt = f"""Extract the key requirements from the following job description in a list of strings:
     
     Job Description:
@@ -55,52 +51,97 @@ def get_job_requirements(description: str) -> List[str]:
     Report only skills mentioned in the job description, for example if the position is for a Java Developer and in the job description it mentions "Java", "PHP", "CSS", the response should be ["Java", "PHP", "CSS"] and not something not mentioned like Python or Data Analysis.
     """
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "system", "content": "You are an expert at analyzing job descriptions."},
-                      {"role": "user", "content": prompt}],
-            temperature=0.1,
-            response_format={"type": "json_object"},
-        )
-        
-        result = response.choices[0].message.content
-        requirements_data = json.loads(result)
+    requirements_data = await get_llm_client().complete_json("job_requirements", "You are an expert at analyzing job descriptions.", prompt)
 
-        if isinstance(requirements_data, list):
-            return requirements_data
+    if isinstance(requirements_data, list):
+        return requirements_data
+    
+    elif isinstance(requirements_data, dict):
+        possible_keys = ["key_requirements", "skills", "hard_skills", "requirements", "technologies"]
         
-        elif isinstance(requirements_data, dict):
-            possible_keys = ["key_requirements", "skills", "hard_skills", "requirements", "technologies"]
-            
-            for key in possible_keys:
-                if key in requirements_data and isinstance(requirements_data[key], list):
-                    return requirements_data[key]
-            
-            if all(isinstance(k, str) and isinstance(v, str) for k, v in requirements_data.items()):
-                return list(requirements_data.values())
-            
-            if len(requirements_data) == 1:
-                value = next(iter(requirements_data.values()))
-                if isinstance(value, list):
-                    return value
-
-            skills = []
-            for value in requirements_data.values():
-                if isinstance(value, str):
-                    skills.append(value)
-                elif isinstance(value, list):
-                    skills.extend([item for item in value if isinstance(item, str)])
-            
-            if skills:
-                return skills
+        for key in possible_keys:
+            if key in requirements_data and isinstance(requirements_data[key], list):
+                return requirements_data[key]
         
-        print(f"Could not extract requirements from response: {requirements_data}")
-        return []
+        if all(isinstance(k, str) and isinstance(v, str) for k, v in requirements_data.items()):
+            return list(requirements_data.values())
         
-    except Exception as e:
-        print(f"Error extracting job requirements: {e}")
-        return []
+        if len(requirements_data) == 1:
+            value = next(iter(requirements_data.values()))
+            if isinstance(value, list):
+                return value
+
+        skills = []
+        for value in requirements_data.values():
+            if isinstance(value, str):
+                skills.append(value)
+            elif isinstance(value, list):
+                skills.extend([item for item in value if isinstance(item, str)])
+        
+        if skills:
+            return skills
+    
+    raise LLMError(f"Could not extract requirements from response: {requirements_data}")
+
+async def request_job_requirements_batch(descriptions: Dict[str, str]) -> Dict[str, List[str]]:
+    """ Extract the requirements of several job descriptions with a single chat completion.
+    Returns only the entries that validate against the per-job output schema. """
+    jobs = [
+        {"job_id": job_id, "description": truncate_to_tokens(description, JOB_DESCRIPTION_TOKEN_BUDGET)}
+        for job_id, description in descriptions.items()
+    ]
+
+    prompt = f"""Extract the key requirements from each of the following job descriptions.
+
+    Job Descriptions (JSON):
+    {json.dumps(jobs, ensure_ascii=False)}
+
+    Return ONLY a JSON object in this format: {{"jobs": [{{"job_id": "...", "requirements": ["JavaScript", "React"]}}]}}, with one entry for every job_id above.
+    For each job, requirements is a list of max {MAX_REQUIREMENTS} strings representing the key hard skills, languages and technologies. If a job description has more than {MAX_REQUIREMENTS} skills, return only the most important ones. Very important: Do not include qualifications, degrees or soft skills like "efficiency", "effectiveness", "english fluency" and other similar words or soft skills.
+    Each skill should be a single short string, e.g. "React" and not "proficiency in react". Report only skills mentioned in that job description.
+    """
+
+    result = await get_llm_client().complete_json("job_requirements_batch", "You are an expert at analyzing job descriptions.", prompt)
+    entries = result.get("jobs", []) if isinstance(result, dict) else []
+
+    requirements = {}
+    for entry in entries:
+        try:
+            job_requirements = JobRequirements.model_validate(entry)
+        except Exception as e:
+            print(f"Invalid job requirements entry: {e}")
+            continue
+        if job_requirements.job_id in descriptions:
+            requirements[job_requirements.job_id] = job_requirements.requirements[:MAX_REQUIREMENTS]
+
+    return requirements
+
+async def get_job_requirements_batch(descriptions: Dict[str, str], batch_size: int = REQUIREMENTS_BATCH_SIZE) -> Dict[str, List[str]]:
+    """ Extract requirements for many jobs, sending batch_size descriptions per request.
+    Jobs missing from a batch response or failing validation fall back to get_job_requirements.
+    Jobs whose extraction fails are left out of the result rather than given empty requirements,
+    raises LLMError if no job could be extracted. """
+    requirements = {}
+    items = list(descriptions.items())
+    batches = [dict(items[i:i + batch_size]) for i in range(0, len(items), batch_size)]
+
+    results = await asyncio.gather(*(request_job_requirements_batch(batch) for batch in batches), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Error extracting job requirements in batch: {result}")
+        else:
+            requirements.update(result)
 
+    missing = [job_id for job_id in descriptions if job_id not in requirements]
+    fallbacks = await asyncio.gather(*(get_job_requirements(descriptions[job_id]) for job_id in missing), return_exceptions=True)
+    for job_id, result in zip(missing, fallbacks):
+        if isinstance(result, Exception):
+            print(f"Error extracting job requirements: {result}")
+        else:
+            requirements[job_id] = result
 
+    failures = [result for result in fallbacks if isinstance(result, Exception)]
+    if descriptions and not requirements:
+        raise LLMError(f"no requirements extracted for {len(descriptions)} jobs: {failures[-1] if failures else 'empty response'}")
 
+    return requirements
@@ -0,0 +1,86 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from api.models.models import CvSummary, CvSummaryCacheEntry
+from api.functions.supabase import get_cv_summary_cache_entry, save_cv_summary_cache_entry, delete_expired_cv_summary_cache_entries
+
+CV_SUMMARY_CACHE_BACKEND = os.getenv("CV_SUMMARY_CACHE_BACKEND", "memory")
+CV_SUMMARY_CACHE_TTL = int(os.getenv("CV_SUMMARY_CACHE_TTL", "86400"))
+CV_SUMMARY_CACHE_SIZE = int(os.getenv("CV_SUMMARY_CACHE_SIZE", "1024"))
+
+def hash_cv_text(cleaned_text: str) -> str:
+    return hashlib.sha256(cleaned_text.encode("utf-8")).hexdigest()
+
+class InMemorySummaryCache:
+    """ Per-process cache with TTL expiry and LRU eviction beyond max_size entries. """
+
+    def __init__(self, ttl: int = CV_SUMMARY_CACHE_TTL, max_size: int = CV_SUMMARY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    async def get(self, text_hash: str) -> CvSummary | None:
+        with self.lock:
+            entry = self.entries.get(text_hash)
+            if entry is None:
+                return None
+
+            expires_at, summary = entry
+            if expires_at < time.monotonic():
+                del self.entries[text_hash]
+                return None
+
+            self.entries.move_to_end(text_hash)
+            return summary.model_copy(deep=True)
+
+    async def set(self, text_hash: str, summary: CvSummary) -> None:
+        with self.lock:
+            self.entries[text_hash] = (time.monotonic() + self.ttl, summary.model_copy(deep=True))
+            self.entries.move_to_end(text_hash)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+class SupabaseSummaryCache:
+    """ Cache shared by all workers, stored in the cv_summaries table.
+    Entries older than the TTL are ignored and periodically deleted. """
+
+    def __init__(self, ttl: int = CV_SUMMARY_CACHE_TTL):
+        self.ttl = ttl
+        self.last_cleanup = 0.0
+
+    async def get(self, text_hash: str) -> CvSummary | None:
+        created_after = (datetime.now() - timedelta(seconds=self.ttl)).isoformat()
+        entry = await get_cv_summary_cache_entry(text_hash, created_after)
+        return entry.summary if entry else None
+
+    async def set(self, text_hash: str, summary: CvSummary) -> None:
+        now = datetime.now()
+        await save_cv_summary_cache_entry(CvSummaryCacheEntry(text_hash=text_hash, summary=summary, created_at=now.isoformat()))
+
+        if time.monotonic() - self.last_cleanup > self.ttl:
+            self.last_cleanup = time.monotonic()
+            await delete_expired_cv_summary_cache_entries((now - timedelta(seconds=self.ttl)).isoformat())
+
+SUMMARY_CACHE_BACKENDS = {
+    "memory": InMemorySummaryCache,
+    "supabase": SupabaseSummaryCache,
+}
+
+summary_cache = SUMMARY_CACHE_BACKENDS[CV_SUMMARY_CACHE_BACKEND]()
+
+async def get_cached_summary(cleaned_text: str) -> CvSummary | None:
+    try:
+        return await summary_cache.get(hash_cv_text(cleaned_text))
+    except Exception as e:
+        print(f"Error reading CV summary cache: {str(e)}")
+        return None
+
+async def cache_summary(cleaned_text: str, summary: CvSummary) -> None:
+    try:
+        await summary_cache.set(hash_cv_text(cleaned_text), summary)
+    except Exception as e:
+        print(f"Error writing CV summary cache: {str(e)}")
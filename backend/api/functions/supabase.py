@@ -1,19 +1,31 @@
 import os
 import uuid
+import asyncio
 from datetime import datetime
 from fastapi import HTTPException
-from supabase import create_client, Client
-from api.models.models import JobSearchRequest, JobReport, JobPost, ReportPostData, Subscription, MatchScore
-from api.functions.openai import get_job_requirements
+from supabase import acreate_client, AsyncClient
+from api.models.models import JobSearchRequest, JobReport, JobPost, ReportPostData, Subscription, MatchScore, CvSummaryCacheEntry, CreditReservation
 from api.functions.file_processing import get_job_experience
+from api.functions.metrics import instrumented
 
 # Inizializzazione Supabase
 url: str = os.environ.get("SUPABASE_URL")
 service_role_key: str = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-supabase: Client = create_client(url, service_role_key)
+supabase: AsyncClient | None = None
+supabase_lock = asyncio.Lock()
 
-def save_job_report(request: JobSearchRequest) -> str | None:
+async def get_supabase() -> AsyncClient:
+    """ Async Supabase client, created on first use. """
+    global supabase
+    async with supabase_lock:
+        if supabase is None:
+            supabase = await acreate_client(url, service_role_key)
+    return supabase
+
+@instrumented("db")
+async def save_job_report(request: JobSearchRequest) -> str | None:
     try:
+        client = await get_supabase()
         report_data = JobReport(
             user_id=request.user_id,
             filename=request.filename,
@@ -24,7 +36,7 @@ def save_job_report(request: JobSearchRequest) -> str | None:
             created_at=datetime.now().isoformat(),
         )
 
-        result = supabase.table("job_reports").insert(report_data.model_dump()).execute()
+        result = await client.table("job_reports").insert(report_data.model_dump()).execute()
 
         return result.data[0]["id"]
 
@@ -32,112 +44,302 @@ def save_job_report(request: JobSearchRequest) -> str | None:
         raise HTTPException(status_code=500, detail=f"Error saving job report: {str(e)}")
     
 
-def save_job_post(job: dict) -> JobPost | None:
+@instrumented("db")
+async def get_job_report(job_report_id: str) -> dict | None:
     try:
-        job_id = job.get("job_id")
+        client = await get_supabase()
+        result = await client.table("job_reports").select("*").eq("id", job_report_id).execute()
+        return result.data[0] if result.data else None
 
-        existing_job = supabase.table("job_posts").select("*").eq("job_id", job_id).execute()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching job report: {str(e)}")
 
-        if existing_job.data:
-            return existing_job.data[0]
+@instrumented("db")
+async def get_report_job_post_ids(job_report_id: str) -> list:
+    """ Ids of the job posts linked to a report through job_report_posts. """
+    try:
+        client = await get_supabase()
+        result = await client.table("job_report_posts").select("job_post_id").eq("job_report_id", job_report_id).execute()
+        return [row["job_post_id"] for row in result.data]
 
-        job_post = JobPost(
-            job_id=job_id,
-            company=job.get("employer_name"),
-            role=job.get("job_title"),
-            location=job.get("job_city"),
-            years_experience=get_job_experience(job.get("job_description")),
-            description=job.get("job_description"),
-            requirements=get_job_requirements(job.get("job_description")),
-            url=job.get("job_apply_link"),
-            salary=job.get("job_salary"),
-            created_at=datetime.now().isoformat(),
-        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching report job posts: {str(e)}")
+
+@instrumented("db")
+async def get_existing_job_posts(job_ids: list) -> dict:
+    """ Fetch the job posts already stored for the given JSearch job ids with a single query.
+    Returns a dict mapping job_id to the stored row. """
+    try:
+        if not job_ids:
+            return {}
+
+        client = await get_supabase()
+        result = await client.table("job_posts").select("*").in_("job_id", job_ids).execute()
+        return {row["job_id"]: row for row in result.data}
 
-        result = supabase.table("job_posts").insert(job_post.model_dump()).execute()
-        return result.data[0]
-    
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error saving job post: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching existing job posts: {str(e)}")
 
-def create_report_post_association(job_report_id: str, job_post_id: str) -> str | None:
+def build_job_post(job: dict, requirements: list) -> JobPost:
+    """ Build a JobPost from a JSearch result and its extracted requirements. """
+    return JobPost(
+        job_id=job.get("job_id"),
+        company=job.get("employer_name"),
+        role=job.get("job_title"),
+        location=job.get("job_city"),
+        years_experience=get_job_experience(job.get("job_description")),
+        description=job.get("job_description"),
+        requirements=requirements,
+        url=job.get("job_apply_link"),
+        salary=job.get("job_salary"),
+        created_at=datetime.now().isoformat(),
+    )
+
+@instrumented("db")
+async def upsert_job_posts(job_posts: list) -> dict:
+    """ Store job posts with a single multi-row upsert on job_id, so a job stored
+    meanwhile by another search or worker is updated instead of failing the batch.
+    Returns a dict mapping job_id to the stored row. """
+    try:
+        if not job_posts:
+            return {}
+
+        client = await get_supabase()
+        result = await client.table("job_posts").upsert([job_post.model_dump() for job_post in job_posts], on_conflict="job_id").execute()
+        return {row["job_id"]: row for row in result.data}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving job posts: {str(e)}")
+
+@instrumented("db")
+async def get_job_posts_page(offset: int, limit: int) -> list:
+    """ A page of stored job posts in id order, used by the requirements backfill. """
     try:
-        report_post_data = ReportPostData(
-            job_report_id=job_report_id,
-            job_post_id=job_post_id
+        client = await get_supabase()
+        result = await (
+            client.table("job_posts")
+            .select("*")
+            .order("id")
+            .range(offset, offset + limit - 1)
+            .execute()
         )
+        return result.data
 
-        result = supabase.table("job_report_posts").insert(report_post_data.model_dump()).execute()
-        return result.data[0]["id"]
-    
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error creating report post association: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching job posts: {str(e)}")
 
-def user_has_credits(user_id: str) -> bool:
+@instrumented("db")
+async def update_job_requirements(rows: list, requirements: dict) -> None:
+    """ Replace the requirements of stored job posts with a single upsert on job_id.
+    rows are the full stored rows, requirements maps job_id to the new list. """
     try:
-        user_subscription = (
-            supabase.table("subscriptions")
+        updated_rows = [{**row, "requirements": requirements[row["job_id"]]} for row in rows if row["job_id"] in requirements]
+        if not updated_rows:
+            return
+
+        client = await get_supabase()
+        await client.table("job_posts").upsert(updated_rows, on_conflict="job_id", returning="minimal").execute()
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating job requirements: {str(e)}")
+
+@instrumented("db")
+async def get_subscription_plan(user_id: str) -> dict:
+    """ Plan and credits of a user's subscription. """
+    try:
+        client = await get_supabase()
+        user_subscription = await (
+            client.table("subscriptions")
             .select("plan, credits")
             .eq("user_id", user_id)
             .single()
             .execute()
         )
+        return user_subscription.data
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error checking credits: {str(e)}")
 
-        if not user_subscription.data:
-            raise HTTPException(status_code=404, detail="Subscription not found")
+@instrumented("db")
+async def reserve_search_credit(user_id: str) -> CreditReservation:
+    """ Take a credit from a free plan with a single conditional UPDATE (reserve_search_credit RPC),
+    so concurrent searches of the same user cannot spend the same credit. """
+    try:
+        client = await get_supabase()
+        result = await client.rpc("reserve_search_credit", {"p_user_id": user_id}).execute()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reserving credit: {str(e)}")
 
-        subscription = user_subscription.data
+    if not result.data:
+        raise HTTPException(status_code=404, detail="Subscription not found")
 
-        return not (subscription["plan"] == "free" and subscription["credits"] <= 0)
+    return CreditReservation.model_validate(result.data)
+
+@instrumented("db")
+async def refund_search_credit(user_id: str) -> int | None:
+    """ Give back a credit reserved by reserve_search_credit. Returns the credits left. """
+    try:
+        client = await get_supabase()
+        result = await client.rpc("refund_search_credit", {"p_user_id": user_id}).execute()
+        return result.data
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error checking credits: {str(e)}")
-    
-def update_credits(user_id: str) -> bool:
+        raise HTTPException(status_code=500, detail=f"Error refunding credit: {str(e)}")
+
+@instrumented("db")
+async def save_match_scores_batch(user_id: str, job_report_id: str, job_post_ids: list, match_scores: list) -> list:
+    """ Save the match scores of a report with a single multi-row insert.
+    Job post ids come straight from upsert_job_posts, so their existence is not re-checked.
+    Returns the created match score ids in the same order as job_post_ids. """
     try:
-        # Recupera la sottoscrizione
-        user_subscription = (
-            supabase.table("subscriptions")
-            .select("id, credits, plan")
-            .eq("user_id", user_id)
-            .single()
+        if not job_post_ids:
+            return []
+
+        client = await get_supabase()
+        created_at = datetime.now().isoformat()
+        rows = [
+            MatchScore(
+                user_id=user_id,
+                job_post_id=job_post_id,
+                job_report_id=job_report_id,
+                score=match_score,
+                created_at=created_at
+            ).model_dump()
+            for job_post_id, match_score in zip(job_post_ids, match_scores)
+        ]
+
+        result = await client.table("match_scores").insert(rows).execute()
+        ids_by_job_post = {row["job_post_id"]: row["id"] for row in result.data}
+        return [ids_by_job_post.get(job_post_id) for job_post_id in job_post_ids]
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving match scores: {str(e)}")
+
+@instrumented("db")
+async def create_report_post_associations_batch(job_report_id: str, job_post_ids: list) -> list:
+    """ Link all job posts to a report with a single multi-row insert.
+    Returns the created association ids in the same order as job_post_ids. """
+    try:
+        if not job_post_ids:
+            return []
+
+        client = await get_supabase()
+        rows = [
+            ReportPostData(job_report_id=job_report_id, job_post_id=job_post_id).model_dump()
+            for job_post_id in job_post_ids
+        ]
+
+        result = await client.table("job_report_posts").insert(rows).execute()
+        ids_by_job_post = {row["job_post_id"]: row["id"] for row in result.data}
+        return [ids_by_job_post.get(job_post_id) for job_post_id in job_post_ids]
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating report post associations: {str(e)}")
+
+@instrumented("db")
+async def get_job_embeddings(job_post_ids: list) -> dict:
+    """ Fetch the stored embeddings of the given job posts with a single query.
+    Returns a dict mapping job_post_id to the stored row. """
+    try:
+        if not job_post_ids:
+            return {}
+
+        client = await get_supabase()
+        result = await client.table("job_post_embeddings").select("*").in_("job_post_id", job_post_ids).execute()
+        return {row["job_post_id"]: row for row in result.data}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching job embeddings: {str(e)}")
+
+@instrumented("db")
+async def get_job_embeddings_page(offset: int, limit: int) -> list:
+    """ A page of stored embeddings in job_post_id order, used to build the job index. """
+    try:
+        client = await get_supabase()
+        result = await (
+            client.table("job_post_embeddings")
+            .select("*")
+            .order("job_post_id")
+            .range(offset, offset + limit - 1)
             .execute()
         )
+        return result.data
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching job embeddings: {str(e)}")
+
+@instrumented("db")
+async def get_job_posts_by_ids(job_post_ids: list) -> dict:
+    """ Fetch job posts by primary key with a single query. Returns a dict mapping id to the row. """
+    try:
+        if not job_post_ids:
+            return {}
+
+        client = await get_supabase()
+        result = await client.table("job_posts").select("*").in_("id", job_post_ids).execute()
+        return {row["id"]: row for row in result.data}
 
-        if not user_subscription.data:
-            raise HTTPException(status_code=404, detail="Subscription not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching job posts: {str(e)}")
 
-        subscription = user_subscription.data
+@instrumented("db")
+async def save_job_embeddings(job_embeddings: list) -> None:
+    """ Store job embeddings in bulk, replacing the stale rows of the same job posts. """
+    try:
+        if not job_embeddings:
+            return
 
-        if subscription["plan"] == "free":
-            if subscription["credits"] <= 0:
-                raise HTTPException(status_code=403, detail="No credits left")
-            supabase.table("subscriptions").update(
-                {"credits": subscription["credits"] - 1}, returning="minimal"
-            ).eq("id", subscription["id"]).execute()
+        client = await get_supabase()
+        rows = [job_embedding.model_dump() for job_embedding in job_embeddings]
+        await client.table("job_post_embeddings").upsert(rows, on_conflict="job_post_id", returning="minimal").execute()
 
-        return True
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving job embeddings: {str(e)}")
+
+@instrumented("db")
+async def delete_job_report(job_report_id: str) -> None:
+    try:
+        client = await get_supabase()
+        await client.table("job_reports").delete(returning="minimal").eq("id", job_report_id).execute()
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error updating credits: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error deleting job report: {str(e)}")
 
-def save_match_score(user_id: str, job_post_id: str, job_report_id: str, match_score: float) -> str | None:
+@instrumented("db")
+async def get_cv_summary_cache_entry(text_hash: str, created_after: str) -> CvSummaryCacheEntry | None:
+    """ Fetch a cached CV summary stored after created_after, if any. """
     try:
-        existing_job = supabase.table("job_posts").select("id").eq("id", job_post_id).execute()
-        if not existing_job.data:
-            raise HTTPException(status_code=400, detail="Job post not found")
-        
-        match_score_data = MatchScore(
-            user_id=user_id,    
-            job_post_id=job_post_id,
-            job_report_id=job_report_id,
-            score=match_score,
-            created_at=datetime.now().isoformat()
+        client = await get_supabase()
+        result = await (
+            client.table("cv_summaries")
+            .select("*")
+            .eq("text_hash", text_hash)
+            .gte("created_at", created_after)
+            .execute()
         )
 
-        result = supabase.table("match_scores").insert(match_score_data.model_dump()).execute()
-        return result.data[0]["id"]
-    
+        if not result.data:
+            return None
+
+        return CvSummaryCacheEntry.model_validate(result.data[0])
+
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error saving match score: {str(e)}")
-    
+        raise HTTPException(status_code=500, detail=f"Error fetching cached CV summary: {str(e)}")
+
+@instrumented("db")
+async def save_cv_summary_cache_entry(entry: CvSummaryCacheEntry) -> None:
+    try:
+        client = await get_supabase()
+        await client.table("cv_summaries").upsert(entry.model_dump(), on_conflict="text_hash", returning="minimal").execute()
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving cached CV summary: {str(e)}")
+
+@instrumented("db")
+async def delete_expired_cv_summary_cache_entries(created_before: str) -> None:
+    try:
+        client = await get_supabase()
+        await client.table("cv_summaries").delete(returning="minimal").lt("created_at", created_before).execute()
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting expired CV summaries: {str(e)}")
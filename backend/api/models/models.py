@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 
 class CvSummary(BaseModel):
     role: str 
@@ -15,6 +15,8 @@ class JobSearchRequest(BaseModel):
     user_id: str
     filename: str
     skills: List[str] = []
+    # "local_first" aggiunge ai risultati di JSearch i job salvati più vicini al CV
+    search_mode: Literal["jsearch", "local_first"] = "jsearch"
 
 class JobReport(BaseModel):
     user_id: str
@@ -51,6 +53,14 @@ class Subscription(BaseModel):
     payment_provider: str
     payment_id: str
 
+class CreditReservation(BaseModel):
+    plan: str
+    # Crediti rimasti dopo la prenotazione, None se il piano a pagamento viene dalla cache
+    credits: Optional[int] = None
+    # allowed: la ricerca può partire; reserved: è stato scalato un credito da restituire in caso di errore
+    allowed: bool
+    reserved: bool
+
 class MatchScore(BaseModel):
     user_id: str
     job_post_id: str
@@ -58,3 +68,62 @@ class MatchScore(BaseModel):
     score: int
     created_at: str
 
+
+class JobEmbedding(BaseModel):
+    job_post_id: str
+    text_hash: str
+    role_embedding: List[float]
+    location_embedding: List[float]
+    skills_embedding: List[float]
+    updated_at: str
+
+class SearchProgress(BaseModel):
+    job_report_id: str
+    status: str = "queued"
+    jobs_fetched: int = 0
+    local_jobs: int = 0
+    requirements_extracted: int = 0
+    jobs_saved: int = 0
+    scores_calculated: int = 0
+    scores_saved: int = 0
+    error: Optional[str] = None
+    # Crediti rimasti a ricerca completata, None per i piani a pagamento
+    credits_remaining: Optional[int] = None
+    # Durata delle fasi in ms e numero di chiamate esterne (db, llm, jsearch)
+    timings: Dict[str, float] = {}
+    calls: Dict[str, int] = {}
+    created_at: str
+    updated_at: str
+
+class JobMatch(BaseModel):
+    job_post_id: str
+    job_id: str
+    company: Optional[str] = None
+    role: Optional[str] = None
+    location: Optional[str] = None
+    years_experience: Optional[int] = None
+    requirements: List[str] = []
+    url: Optional[str] = None
+    salary: Optional[str] = None
+    match_score: int
+
+class SearchCompleted(BaseModel):
+    job_report_id: str
+    jobs: int
+    # Crediti rimasti dopo la ricerca, None per i piani a pagamento
+    credits_remaining: Optional[int] = None
+
+class RescoreCompleted(BaseModel):
+    job_report_id: str
+    source_job_report_id: str
+    # Ordinati per punteggio decrescente
+    jobs: List[JobMatch]
+
+class JobRequirements(BaseModel):
+    job_id: str
+    requirements: List[str]
+
+class CvSummaryCacheEntry(BaseModel):
+    text_hash: str
+    summary: CvSummary
+    created_at: str
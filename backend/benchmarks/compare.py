@@ -0,0 +1,65 @@
+""" Compare two benchmark result files written by benchmarks.run.
+
+Usage, from the backend directory:
+    python -m benchmarks.compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+    python -m benchmarks.compare base.json head.json --threshold 15 --fail-on-regression
+"""
+import sys
+import json
+import argparse
+
+def load_results(path: str) -> dict:
+    with open(path) as results_file:
+        return json.load(results_file)
+
+def change(base: float | None, head: float | None) -> float | None:
+    """ Relative change in percent, None when either side is missing. """
+    if base is None or head is None or base == 0:
+        return None
+    return (head - base) / base * 100
+
+def format_change(value: float | None) -> str:
+    return "     n/a" if value is None else f"{value:+7.1f}%"
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=10, help="p50/p95 increase in percent reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    base, head = load_results(args.base), load_results(args.head)
+    if base.get("config") != head.get("config"):
+        print("Warning: the two runs used a different configuration, numbers may not be comparable\n")
+
+    print(f"{'benchmark':<32} {'p50 ' + base['commit']:>16} {'p50 ' + head['commit']:>16} {'change':>8} "
+          f"{'p95 change':>11} {'throughput':>11} {'peak MB':>9}")
+
+    regressions = []
+    for name in sorted(set(base["results"]) | set(head["results"])):
+        base_result, head_result = base["results"].get(name), head["results"].get(name)
+        if base_result is None or head_result is None:
+            print(f"{name:<32} only in {'head' if base_result is None else 'base'}")
+            continue
+
+        p50_change = change(base_result["p50_ms"], head_result["p50_ms"])
+        p95_change = change(base_result["p95_ms"], head_result["p95_ms"])
+        throughput_change = change(base_result["throughput_per_s"], head_result["throughput_per_s"])
+        memory_change = change(base_result["peak_rss_mb"], head_result["peak_rss_mb"])
+
+        regressed = any(value is not None and value > args.threshold for value in (p50_change, p95_change))
+        if regressed:
+            regressions.append(name)
+
+        print(f"{name:<32} {base_result['p50_ms']:13.2f} ms {head_result['p50_ms']:13.2f} ms {format_change(p50_change)} "
+              f"{format_change(p95_change):>11} {format_change(throughput_change):>11} {format_change(memory_change):>9}"
+              f"{'  REGRESSION' if regressed else ''}")
+
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) slower by more than {args.threshold:g}%: {', '.join(regressions)}")
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
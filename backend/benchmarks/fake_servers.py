@@ -0,0 +1,371 @@
+""" Local stand-ins for JSearch, OpenAI and PostgREST (Supabase), with configurable latency.
+Each server runs on its own thread and only implements what the backend actually calls. """
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import collections
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+import torch
+
+SKILLS = [
+    "Python", "JavaScript", "TypeScript", "React", "Node.js", "Java", "Spring", "Go", "Rust", "SQL",
+    "PostgreSQL", "Docker", "Kubernetes", "AWS", "Azure", "GCP", "Terraform", "Django", "FastAPI", "Kafka",
+    "Spark", "Pandas", "PyTorch", "TensorFlow", "GraphQL", "Redis", "Linux", "CI/CD", "Vue", "Angular",
+]
+CITIES = ["Milano", "Roma", "Torino", "Bologna", "Firenze", "Napoli", "Remote"]
+COMPANIES = ["Acme", "Globex", "Initech", "Umbrella", "Hooli", "Stark", "Wayne", "Wonka"]
+# Risposta senza corpo (Prefer: return=minimal), diversa da un JSON null
+NO_CONTENT = object()
+
+class FakeServer:
+    """ Base class: a ThreadingHTTPServer bound to a free local port, sleeping `latency`
+    seconds (plus up to `jitter`) before answering each request. """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.build_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, method: str, path: str, query: list, headers: dict, body) -> tuple:
+        """ Return (status, headers, json body or NO_CONTENT). """
+        raise NotImplementedError
+
+    def build_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def dispatch(self):
+                with fake.lock:
+                    fake.requests += 1
+                delay = fake.latency + random.uniform(0, fake.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                body = json.loads(raw) if raw else None
+                split = urlsplit(self.path)
+                headers = {key.lower(): value for key, value in self.headers.items()}
+
+                try:
+                    status, response_headers, payload = fake.handle(self.command, split.path, parse_qsl(split.query), headers, body)
+                except Exception as e:
+                    status, response_headers, payload = 500, {}, {"message": str(e)}
+
+                data = json.dumps(payload).encode("utf-8") if payload is not NO_CONTENT else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in response_headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = dispatch
+
+        return Handler
+
+class FakeJSearch(FakeServer):
+    """ Returns `jobs_per_page` deterministic job results per query. Job ids depend on the
+    query, so repeated queries hit job posts already stored by earlier searches. """
+
+    def __init__(self, jobs_per_page: int = 10, **kwargs):
+        super().__init__(**kwargs)
+        self.jobs_per_page = jobs_per_page
+
+    @property
+    def url(self) -> str:
+        return f"{super().url}/search"
+
+    def handle(self, method, path, query, headers, body):
+        params = dict(query)
+        seed = hashlib.sha256(f"{params.get('query')}|{params.get('page')}".encode()).hexdigest()
+        rng = random.Random(seed)
+        role = (params.get("query") or "developer").split(" in ")[0]
+
+        jobs = []
+        for i in range(self.jobs_per_page):
+            skills = rng.sample(SKILLS, 6)
+            years = rng.randint(0, 8)
+            description = (
+                f"We are looking for a {role} to join our team. "
+                f"You have at least {years} years of experience with {', '.join(skills[:-1])} and {skills[-1]}. "
+                + "You will design, build and operate services used by thousands of customers. " * rng.randint(2, 8)
+            )
+            jobs.append({
+                "job_id": f"{seed[:12]}-{i}",
+                "employer_name": rng.choice(COMPANIES),
+                "job_title": f"{rng.choice(['Junior', 'Senior', 'Lead', ''])} {role}".strip(),
+                "job_city": rng.choice(CITIES),
+                "job_description": description,
+                "job_apply_link": f"https://jobs.example.com/{seed[:12]}/{i}",
+                "job_salary": None,
+            })
+
+        return 200, {}, {"status": "OK", "data": jobs}
+
+class FakeOpenAI(FakeServer):
+    """ Chat completions endpoint answering the CV summary, single and batch requirement
+    prompts. Requirements are the known skills mentioned in each description.
+    With requests_per_second set, requests over the limit get a 429 with Retry-After,
+    like the real API under a burst. """
+
+    def __init__(self, requests_per_second: float | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.requests_per_second = requests_per_second
+        self.recent_requests = collections.deque()
+        self.rate_limited = 0
+
+    def over_rate_limit(self) -> bool:
+        if not self.requests_per_second:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            while self.recent_requests and now - self.recent_requests[0] > 1:
+                self.recent_requests.popleft()
+            if len(self.recent_requests) >= self.requests_per_second:
+                self.rate_limited += 1
+                return True
+            self.recent_requests.append(now)
+            return False
+
+    @staticmethod
+    def find_skills(text: str) -> list:
+        return [skill for skill in SKILLS if skill.lower() in text.lower()][:8]
+
+    def handle(self, method, path, query, headers, body):
+        if not path.endswith("/chat/completions"):
+            return 404, {}, {"error": {"message": f"Unknown path {path}"}}
+        if self.over_rate_limit():
+            return 429, {"Retry-After": "1"}, {"error": {"message": "Rate limit reached for requests", "type": "requests", "code": "rate_limit_exceeded"}}
+
+        prompt = body["messages"][-1]["content"]
+        if "Job Descriptions (JSON):" in prompt:
+            jobs = json.loads(prompt.split("Job Descriptions (JSON):", 1)[1].split("\n    Return ONLY", 1)[0])
+            content = {"jobs": [{"job_id": job["job_id"], "requirements": self.find_skills(job["description"])} for job in jobs]}
+        elif "Analyze the following CV" in prompt:
+            content = {
+                "role": "Backend Developer",
+                "years_experience": 5,
+                "location": "Milano",
+                "skills": self.find_skills(prompt.split("Extract the following information", 1)[0]),
+                "education": [],
+                "summary": "Backend developer with experience in distributed systems.",
+            }
+        else:
+            content = {"skills": self.find_skills(prompt.split("Return ONLY", 1)[0])}
+
+        message = json.dumps(content)
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(message) // 4
+        return 200, {}, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-3.5-turbo"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": message}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+class FakePostgREST(FakeServer):
+    """ In-memory PostgREST with the tables, unique keys and filters used by the backend.
+    Supports eq/neq/gt/gte/lt/lte/in filters, order/limit/offset, Prefer return= and
+    resolution= headers, single-object responses and upserts with on_conflict. """
+
+    UNIQUE_KEYS = {
+        "job_posts": ["job_id"],
+        "job_post_embeddings": ["job_post_id"],
+        "cv_summaries": ["text_hash"],
+        "job_report_posts": ["job_report_id", "job_post_id"],
+        "subscriptions": ["user_id"],
+    }
+    # Tabelle senza colonna id generata
+    NATURAL_KEYS = {"job_post_embeddings", "cv_summaries"}
+    IGNORED_PARAMS = {"select", "on_conflict", "columns", "order", "limit", "offset"}
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.tables = {}
+        self.rpc_functions = {
+            "reserve_search_credit": reserve_search_credit,
+            "refund_search_credit": refund_search_credit,
+        }
+        self.data_lock = threading.Lock()
+
+    def add_rows(self, table: str, rows: list) -> list:
+        with self.data_lock:
+            return [self.insert_row(table, dict(row), merge=False) for row in rows]
+
+    def insert_row(self, table: str, row: dict, merge: bool, on_conflict: list | None = None) -> dict:
+        rows = self.tables.setdefault(table, [])
+        keys = on_conflict or self.UNIQUE_KEYS.get(table)
+        if keys:
+            for existing in rows:
+                if all(existing.get(key) == row.get(key) for key in keys):
+                    if not merge:
+                        raise ValueError(f'duplicate key value violates unique constraint "{table}_{"_".join(keys)}_key"')
+                    existing.update(row)
+                    return existing
+
+        if table not in self.NATURAL_KEYS:
+            row.setdefault("id", str(uuid.uuid4()))
+        row.setdefault("created_at", datetime.now().isoformat())
+        rows.append(row)
+        return row
+
+    @staticmethod
+    def parse_value(value: str):
+        for cast in (int, float):
+            try:
+                return cast(value)
+            except ValueError:
+                pass
+        return value
+
+    def matches(self, row: dict, filters: list) -> bool:
+        for column, expression in filters:
+            operator, _, value = expression.partition(".")
+            current = row.get(column)
+            if operator == "in":
+                values = [self.parse_value(v.strip('"')) for v in re.findall(r'"[^"]*"|[^,()]+', value)]
+                if current not in values:
+                    return False
+                continue
+
+            value = self.parse_value(value)
+            if operator == "eq" and current != value:
+                return False
+            if operator == "neq" and current == value:
+                return False
+            if operator in ("gt", "gte", "lt", "lte"):
+                if current is None:
+                    return False
+                if isinstance(value, str) or isinstance(current, str):
+                    current, value = str(current), str(value)
+                if operator == "gt" and not current > value:
+                    return False
+                if operator == "gte" and not current >= value:
+                    return False
+                if operator == "lt" and not current < value:
+                    return False
+                if operator == "lte" and not current <= value:
+                    return False
+        return True
+
+    def handle(self, method, path, query, headers, body):
+        if not path.startswith("/rest/v1/"):
+            return 404, {}, {"message": f"Unknown path {path}"}
+
+        name = path[len("/rest/v1/"):]
+        prefer = headers.get("prefer", "")
+        single = "vnd.pgrst.object" in headers.get("accept", "")
+        filters = [(column, value) for column, value in query if column not in self.IGNORED_PARAMS]
+        on_conflict = dict(query).get("on_conflict")
+
+        with self.data_lock:
+            if name.startswith("rpc/"):
+                function = self.rpc_functions.get(name[len("rpc/"):])
+                if function is None:
+                    return 404, {}, {"code": "PGRST202", "message": f"Could not find the function {name}"}
+                return 200, {}, function(self, body or {})
+
+            rows = self.tables.setdefault(name, [])
+            if method == "GET":
+                result = [dict(row) for row in rows if self.matches(row, filters)]
+                params = dict(query)
+                for order in reversed(params.get("order", "").split(",") if params.get("order") else []):
+                    column, _, direction = order.partition(".")
+                    result.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=direction.startswith("desc"))
+                offset = int(params.get("offset", 0))
+                result = result[offset:offset + int(params["limit"])] if "limit" in params else result[offset:]
+            elif method == "POST":
+                merge = "resolution=merge-duplicates" in prefer
+                new_rows = body if isinstance(body, list) else [body]
+                try:
+                    result = [dict(self.insert_row(name, dict(row), merge, on_conflict.split(",") if on_conflict else None)) for row in new_rows]
+                except ValueError as e:
+                    return 409, {}, {"code": "23505", "message": str(e), "details": None, "hint": None}
+            elif method == "PATCH":
+                result = []
+                for row in rows:
+                    if self.matches(row, filters):
+                        row.update(body)
+                        result.append(dict(row))
+            elif method == "DELETE":
+                result = [dict(row) for row in rows if self.matches(row, filters)]
+                self.tables[name] = [row for row in rows if not self.matches(row, filters)]
+            else:
+                return 405, {}, {"message": f"Method {method} not allowed"}
+
+        if "return=minimal" in prefer:
+            return 204 if method != "POST" else 201, {}, NO_CONTENT
+
+        if single:
+            if len(result) != 1:
+                return 406, {}, {"code": "PGRST116", "message": "JSON object requested, multiple (or no) rows returned", "details": f"The result contains {len(result)} rows"}
+            result = result[0]
+
+        return 201 if method == "POST" else 200, {}, result
+
+def reserve_search_credit(postgrest: FakePostgREST, args: dict) -> dict | None:
+    """ Same contract as the reserve_search_credit function in snippets.sql. """
+    for subscription in postgrest.tables.get("subscriptions", []):
+        if subscription["user_id"] == args["p_user_id"]:
+            if subscription["plan"] == "free" and subscription["credits"] > 0:
+                subscription["credits"] -= 1
+                return {"plan": "free", "credits": subscription["credits"], "allowed": True, "reserved": True}
+            return {"plan": subscription["plan"], "credits": subscription["credits"], "allowed": subscription["plan"] != "free", "reserved": False}
+    return None
+
+def refund_search_credit(postgrest: FakePostgREST, args: dict) -> int | None:
+    for subscription in postgrest.tables.get("subscriptions", []):
+        if subscription["user_id"] == args["p_user_id"] and subscription["plan"] == "free":
+            subscription["credits"] += 1
+            return subscription["credits"]
+    return None
+
+class HashingEncoder:
+    """ Stand-in for the sentence transformer: deterministic unit vectors seeded by the text
+    hash. Used with --fake-model to measure the pipeline without model inference. """
+
+    def __init__(self, dimension: int = 768):
+        self.dimension = dimension
+        self.device = torch.device("cpu")
+
+    def encode(self, texts, convert_to_tensor: bool = True, batch_size: int | None = None, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        vectors = [
+            torch.randn(self.dimension, generator=torch.Generator().manual_seed(int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)))
+            for text in texts
+        ]
+        vectors = torch.stack(vectors) if vectors else torch.empty(0, self.dimension)
+        return torch.nn.functional.normalize(vectors, dim=-1)
@@ -0,0 +1,84 @@
+""" Synthetic CV documents of a given size, generated at run time so no binaries are committed. """
+import io
+import random
+import docx
+from benchmarks.fake_servers import SKILLS, CITIES, COMPANIES
+
+LINES_PER_PAGE = 45
+
+def build_cv_lines(pages: int, seed: int = 0) -> list:
+    """ About LINES_PER_PAGE lines of plausible CV text per page. """
+    rng = random.Random(seed)
+    lines = ["Mario Rossi - Backend Developer", f"{rng.choice(CITIES)} - mario.rossi@example.com", "Experience"]
+    while len(lines) < pages * LINES_PER_PAGE:
+        lines.append(f"{rng.choice(COMPANIES)} ({rng.randint(2010, 2024)}) - {rng.choice(['Senior', 'Lead', 'Junior'])} Developer")
+        lines.append(f"Built services with {', '.join(rng.sample(SKILLS, 4))} for {rng.randint(2, 90)} customers.")
+        lines.append("Improved latency and reliability of the platform, mentored junior developers.")
+    return lines[:pages * LINES_PER_PAGE]
+
+def escape_pdf_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def build_pdf(pages: int, seed: int = 0) -> bytes:
+    """ Minimal multi-page PDF with a Helvetica text stream per page. """
+    lines = build_cv_lines(pages, seed)
+    page_count = max(pages, 1)
+    font_id = 3
+    first_page_id = 4
+
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        font_id: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    kids = []
+    for page in range(page_count):
+        page_id = first_page_id + page * 2
+        content_id = page_id + 1
+        kids.append(f"{page_id} 0 R")
+
+        page_lines = lines[page * LINES_PER_PAGE:(page + 1) * LINES_PER_PAGE]
+        stream = "BT /F1 10 Tf 14 TL 50 800 Td " + " ".join(f"({escape_pdf_text(line)}) '" for line in page_lines) + " ET"
+        stream = stream.encode("latin-1")
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode("latin-1")
+        objects[content_id] = f"<< /Length {len(stream)} >>\nstream\n".encode("latin-1") + stream + b"\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {page_count} >>".encode("latin-1")
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = output.tell()
+        output.write(f"{object_id} 0 obj\n".encode("latin-1") + objects[object_id] + b"\nendobj\n")
+
+    xref_offset = output.tell()
+    size = max(objects) + 1
+    output.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode("latin-1"))
+    for object_id in range(1, size):
+        output.write(f"{offsets[object_id]:010d} 00000 n \n".encode("latin-1"))
+    output.write(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1"))
+    return output.getvalue()
+
+def build_docx(pages: int, seed: int = 0) -> bytes:
+    """ DOCX with one paragraph per CV line, roughly `pages` pages long. """
+    document = docx.Document()
+    for line in build_cv_lines(pages, seed):
+        document.add_paragraph(line)
+
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+def build_cv_fixtures(page_counts: list) -> dict:
+    """ PDF and DOCX fixtures for each page count, keyed like "pdf-5p". """
+    fixtures = {}
+    for pages in page_counts:
+        fixtures[f"pdf-{pages}p"] = ("cv.pdf", "application/pdf", build_pdf(pages, seed=pages))
+        fixtures[f"docx-{pages}p"] = (
+            "cv.docx",
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            build_docx(pages, seed=pages),
+        )
+    return fixtures
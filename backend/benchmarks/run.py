@@ -0,0 +1,374 @@
+""" Benchmark the CV parsing, embedding, scoring and full /search paths.
+
+External services are replaced by local fake servers (JSearch, OpenAI, PostgREST) with
+configurable latency, so runs are reproducible and cost nothing. Each benchmark reports
+p50/p95 latency, throughput and the peak resident memory measured while it ran.
+Results are written to benchmarks/results/<commit>.json, compare two runs with
+benchmarks.compare.
+
+Usage, from the backend directory:
+    python -m benchmarks.run --suites cv,encode,scoring,search --iterations 20
+    python -m benchmarks.run --fake-model --db-latency-ms 5 --openai-latency-ms 300
+"""
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import platform
+import argparse
+import resource
+import threading
+import subprocess
+from datetime import datetime
+from benchmarks.fake_servers import FakeJSearch, FakeOpenAI, FakePostgREST, HashingEncoder, SKILLS, CITIES
+from benchmarks.fixtures import build_cv_fixtures
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+SUITES = ["cv", "encode", "scoring", "search"]
+BENCH_USER_ID = "00000000-0000-0000-0000-000000000001"
+# JWT fittizio, il client Supabase valida solo il formato della chiave
+BENCH_SERVICE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark"
+
+def percentile(values: list, fraction: float) -> float:
+    """ Nearest-rank percentile of a non-empty list. """
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        # ru_maxrss è in KB su Linux, in byte su macOS
+        divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+
+class MemorySampler:
+    """ Samples the resident memory every `interval` seconds in a background thread,
+    keeping the peak seen while the block runs. Catches native (torch) allocations too. """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start_mb = 0.0
+        self.peak_mb = 0.0
+        self.stopped = threading.Event()
+
+    def sample(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __enter__(self) -> "MemorySampler":
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stopped.set()
+        self.thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+def summarize(durations: list, wall_seconds: float, operations: int, memory: MemorySampler, **extra) -> dict:
+    return {
+        "iterations": len(durations),
+        "p50_ms": percentile(durations, 0.50) * 1000,
+        "p95_ms": percentile(durations, 0.95) * 1000,
+        "mean_ms": sum(durations) / len(durations) * 1000,
+        "min_ms": min(durations) * 1000,
+        "max_ms": max(durations) * 1000,
+        "throughput_per_s": operations / wall_seconds if wall_seconds > 0 else None,
+        "peak_rss_mb": memory.peak_mb,
+        "rss_growth_mb": memory.peak_mb - memory.start_mb,
+        **extra,
+    }
+
+async def measure(run, iterations: int, concurrency: int = 1, operations_per_run: int = 1, **extra) -> dict:
+    """ Await run(i) `iterations` times, at most `concurrency` at a time. """
+    semaphore = asyncio.Semaphore(concurrency)
+    durations = []
+
+    async def timed(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await run(i)
+            durations.append(time.perf_counter() - start)
+
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        await asyncio.gather(*(timed(i) for i in range(iterations)))
+        wall_seconds = time.perf_counter() - start
+
+    return summarize(durations, wall_seconds, iterations * operations_per_run, memory, concurrency=concurrency, **extra)
+
+def report(results: dict, name: str, result: dict) -> None:
+    results[name] = result
+    print(f"{name:<32} p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+          f"{result['throughput_per_s'] or 0:9.1f}/s  peak {result['peak_rss_mb']:7.1f} MB")
+
+async def bench_cv(args, results: dict) -> None:
+    from fastapi import UploadFile
+    from starlette.datastructures import Headers
+    from api.functions.file_processing import process_cv, clean_text, extract_text_from_pdf
+
+    for name, (filename, content_type, data) in build_cv_fixtures(args.cv_pages).items():
+        async def run(i: int) -> None:
+            upload = UploadFile(file=io.BytesIO(data), filename=filename, headers=Headers({"content-type": content_type}))
+            await process_cv(upload)
+
+        report(results, f"process_cv/{name}", await measure(run, args.iterations, size_bytes=len(data)))
+
+        if filename.endswith(".pdf"):
+            raw_text = extract_text_from_pdf(io.BytesIO(data))
+
+            async def run_clean(i: int) -> None:
+                clean_text(raw_text)
+
+            report(results, f"clean_text/{name}", await measure(run_clean, args.iterations, chars=len(raw_text)))
+
+async def bench_encode(args, results: dict) -> None:
+    from api.functions import match_score
+
+    for size in args.encode_sizes:
+        async def run_cold(i: int) -> None:
+            # Testi unici per iterazione, nessun hit nella cache LRU
+            await match_score.encode_texts([f"Skills: {SKILLS[j % len(SKILLS)].lower()} {i}-{j}" for j in range(size)])
+
+        report(results, f"encode_texts/cold/{size}", await measure(run_cold, args.iterations, operations_per_run=size))
+
+        warm_texts = [f"Skills: {SKILLS[j % len(SKILLS)].lower()} warm-{j}" for j in range(size)]
+        await match_score.encode_texts(warm_texts)
+
+        async def run_warm(i: int) -> None:
+            await match_score.encode_texts(warm_texts)
+
+        report(results, f"encode_texts/warm/{size}", await measure(run_warm, args.iterations, operations_per_run=size))
+
+    # Richieste concorrenti da 3 testi (come preprocess_cv), unite dal batcher
+    async def run_concurrent(i: int) -> None:
+        await match_score.encode_texts([f"Role: developer {i}", f"Location: milano {i}", f"Skills: python {i}"])
+
+    batches_before = match_score.embedding_batcher.get_stats()["batches"]
+    result = await measure(run_concurrent, args.iterations * args.concurrency, concurrency=args.concurrency * 4, operations_per_run=3)
+    result["batches"] = match_score.embedding_batcher.get_stats()["batches"] - batches_before
+    report(results, "encode_texts/concurrent/3", result)
+
+def seed_job_posts(postgrest: FakePostgREST, count: int, prefix: str) -> list:
+    rows = [{
+        "job_id": f"{prefix}-{i}",
+        "company": "Acme",
+        "role": f"{['Backend', 'Frontend', 'Data', 'DevOps'][i % 4]} Developer",
+        "location": CITIES[i % len(CITIES)],
+        "years_experience": (i % 7) or None,
+        "description": "",
+        "requirements": [SKILLS[(i + j) % len(SKILLS)] for j in range(5)],
+        "url": None,
+        "salary": None,
+    } for i in range(count)]
+    return postgrest.add_rows("job_posts", rows)
+
+async def bench_scoring(args, results: dict, postgrest: FakePostgREST) -> None:
+    from api.models.models import JobSearchRequest
+    from api.functions import match_score
+
+    request = JobSearchRequest(
+        user_id=BENCH_USER_ID, filename="cv.pdf", years_experience=4,
+        role="Backend Developer", location="Milano", skills=["Python", "FastAPI", "PostgreSQL", "Docker"],
+    )
+    cv_vectors = await match_score.preprocess_cv(request)
+
+    for count in args.job_counts:
+        jobs = seed_job_posts(postgrest, count, f"scoring-{count}")
+        job_post_ids = {job["id"] for job in jobs}
+
+        def forget_embeddings() -> None:
+            with postgrest.data_lock:
+                postgrest.tables["job_post_embeddings"] = [
+                    row for row in postgrest.tables.get("job_post_embeddings", []) if row["job_post_id"] not in job_post_ids
+                ]
+            with match_score.embedding_cache_lock:
+                match_score.embedding_cache.clear()
+
+        # Nessun embedding salvato né in cache: encoding di tutti i job e salvataggio nello store
+        durations = []
+        with MemorySampler() as memory:
+            start = time.perf_counter()
+            for _ in range(args.cold_iterations):
+                forget_embeddings()
+                iteration_start = time.perf_counter()
+                await match_score.calculate_match_scores_batch(cv_vectors, jobs)
+                durations.append(time.perf_counter() - iteration_start)
+            wall_seconds = sum(durations) or time.perf_counter() - start
+        report(results, f"match_scores_batch/cold/{count}", summarize(durations, wall_seconds, len(durations) * count, memory, jobs=count))
+
+        # Embedding già nello store: solo lettura e scoring vettoriale
+        async def run_stored(i: int) -> None:
+            await match_score.calculate_match_scores_batch(cv_vectors, jobs)
+
+        report(results, f"match_scores_batch/stored/{count}", await measure(run_stored, args.iterations, operations_per_run=count, jobs=count))
+
+async def bench_search(args, results: dict, servers: dict) -> None:
+    import httpx
+    import main
+
+    servers["postgrest"].add_rows("subscriptions", [{"user_id": BENCH_USER_ID, "plan": "free", "credits": 10 ** 9}])
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+
+            async def run_search(role: str) -> str:
+                response = await client.post("/search", json={
+                    "user_id": BENCH_USER_ID, "filename": "cv.pdf", "years_experience": 4,
+                    "role": role, "location": "Milano", "skills": ["Python", "FastAPI", "PostgreSQL"],
+                })
+                response.raise_for_status()
+                job_report_id = response.json()["job_report_id"]
+
+                while True:
+                    status = (await client.get(f"/search/{job_report_id}/status")).json()
+                    if status["status"] == "completed":
+                        return job_report_id
+                    if status["status"] == "failed":
+                        raise RuntimeError(f"Search failed: {status['error']}")
+                    await asyncio.sleep(args.poll_interval_ms / 1000)
+
+            calls_before = {name: server.requests for name, server in servers.items()}
+
+            # Query mai viste: JSearch, estrazione dei requisiti, encoding e salvataggio di tutti i job
+            result = await measure(lambda i: run_search(f"Cold Role {time.time_ns()} {i}"), args.searches, concurrency=args.concurrency)
+            result["upstream_requests"] = {name: server.requests - calls_before[name] for name, server in servers.items()}
+            report(results, "search/cold", result)
+
+            # Stessa query ripetuta: cache JSearch, job e embedding già salvati
+            await run_search("Warm Role")
+            calls_before = {name: server.requests for name, server in servers.items()}
+            result = await measure(lambda i: run_search("Warm Role"), args.searches, concurrency=args.concurrency)
+            result["upstream_requests"] = {name: server.requests - calls_before[name] for name, server in servers.items()}
+            report(results, "search/warm", result)
+
+            # Stesso report con un CV aggiornato: nessuna chiamata a JSearch o OpenAI
+            job_report_id = await run_search("Warm Role")
+
+            async def rescore(i: int) -> None:
+                response = await client.post(f"/search/{job_report_id}/rescore", json={
+                    "user_id": BENCH_USER_ID, "filename": "cv-v2.pdf", "years_experience": 5,
+                    "role": "Warm Role", "location": "Torino", "skills": ["Python", "Kubernetes", f"Skill {i}"],
+                })
+                response.raise_for_status()
+
+            calls_before = {name: server.requests for name, server in servers.items()}
+            result = await measure(rescore, args.searches, concurrency=args.concurrency)
+            result["upstream_requests"] = {name: server.requests - calls_before[name] for name, server in servers.items()}
+            report(results, "search/rescore", result)
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD", "--", "."], stderr=subprocess.DEVNULL).returncode != 0
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def parse_int_list(value: str) -> list:
+    return [int(item) for item in value.split(",") if item]
+
+async def run_benchmarks(args, servers: dict) -> dict:
+    from api.functions import match_score
+
+    load_seconds = None
+    if {"encode", "scoring", "search"} & set(args.suites):
+        start = time.perf_counter()
+        if args.fake_model:
+            match_score.model = HashingEncoder(match_score.EMBEDDING_DIMENSION)
+        else:
+            match_score.prewarm_model()
+        load_seconds = time.perf_counter() - start
+        print(f"Model ready in {load_seconds:.2f}s ({'fake' if args.fake_model else match_score.EMBEDDING_BACKEND})")
+
+    results = {}
+    if "cv" in args.suites:
+        await bench_cv(args, results)
+    if "encode" in args.suites:
+        await bench_encode(args, results)
+    if "scoring" in args.suites:
+        await bench_scoring(args, results, servers["postgrest"])
+    if "search" in args.suites:
+        await bench_search(args, results, servers)
+
+    return {"model_load_seconds": load_seconds, "results": results}
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suites", type=lambda value: value.split(","), default=SUITES, help=f"comma separated, any of {','.join(SUITES)}")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--cold-iterations", type=int, default=3, help="iterations of the scoring runs that encode every job")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent searches in the search suite")
+    parser.add_argument("--searches", type=int, default=20, help="searches per search scenario")
+    parser.add_argument("--cv-pages", type=parse_int_list, default=[1, 5, 20])
+    parser.add_argument("--encode-sizes", type=parse_int_list, default=[3, 30, 300])
+    parser.add_argument("--job-counts", type=parse_int_list, default=[10, 100, 1000])
+    parser.add_argument("--jobs-per-search", type=int, default=10, help="results returned by the fake JSearch")
+    parser.add_argument("--jsearch-latency-ms", type=float, default=300)
+    parser.add_argument("--openai-latency-ms", type=float, default=800)
+    parser.add_argument("--db-latency-ms", type=float, default=10)
+    parser.add_argument("--openai-rps-limit", type=float, default=None, help="requests per second the fake OpenAI accepts before answering 429")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="random extra latency added to every fake server")
+    parser.add_argument("--poll-interval-ms", type=float, default=20)
+    parser.add_argument("--fake-model", action="store_true", help="replace the sentence transformer with a hashing encoder")
+    parser.add_argument("--output", help="results file, defaults to benchmarks/results/<commit>.json")
+    args = parser.parse_args()
+
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    jitter = args.jitter_ms / 1000
+    servers = {
+        "jsearch": FakeJSearch(jobs_per_page=args.jobs_per_search, latency=args.jsearch_latency_ms / 1000, jitter=jitter).start(),
+        "openai": FakeOpenAI(requests_per_second=args.openai_rps_limit, latency=args.openai_latency_ms / 1000, jitter=jitter).start(),
+        "postgrest": FakePostgREST(latency=args.db_latency_ms / 1000, jitter=jitter).start(),
+    }
+
+    # Le variabili vanno impostate prima di importare i moduli dell'API
+    os.environ.update({
+        "SUPABASE_URL": servers["postgrest"].url,
+        "SUPABASE_SERVICE_ROLE_KEY": BENCH_SERVICE_KEY,
+        "OPENAI_BASE_URL": f"{servers['openai'].url}/v1",
+        "OPENAI_API_KEY": "sk-benchmark",
+        "JSEARCH_URL": servers["jsearch"].url,
+        "RAPIDAPI_KEY": "benchmark",
+        "PREWARM_MODEL": "false",
+        "CV_SUMMARY_CACHE_BACKEND": "memory",
+    })
+
+    try:
+        run = asyncio.run(run_benchmarks(args, servers))
+    finally:
+        for server in servers.values():
+            server.stop()
+
+    import torch
+    commit = git_commit()
+    output = {
+        "commit": commit,
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "torch": torch.__version__,
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        **run,
+    }
+
+    path = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as results_file:
+        json.dump(output, results_file, indent=2)
+    print(f"Results written to {path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
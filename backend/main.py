@@ -1,17 +1,57 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse, JSONResponse
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
-from api.models.models import CvSummary, JobSearchRequest
-from api.functions.file_processing import process_cv
-from api.functions.match_score import calculate_match_scores_batch, preprocess_cv
-from api.functions.fetch_jobs import fetch_jobs_from_api
-from api.functions.openai import generate_summary_with_openai
-from api.functions.supabase import user_has_credits, update_credits, save_job_report, save_job_post, create_report_post_association, save_match_score
+import time
+import json
+import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
-load_dotenv()   
+# Le variabili d'ambiente vanno caricate prima dei moduli api, che le leggono all'import
+load_dotenv()
+
+from api.models.models import CvSummary, JobSearchRequest, SearchProgress, RescoreCompleted
+from api.functions.file_processing import process_cv, CV_MAX_BYTES, CV_MAX_REQUEST_BYTES
+from api.functions.fetch_jobs import close_http_client
+from api.functions.executor import shutdown_process_executor
+from api.functions.job_index import JOB_INDEX_ENABLED, JOB_INDEX_PRELOAD, load_job_index, job_index
+from api.functions.match_score import PREWARM_MODEL, prewarm_model, is_model_loaded, get_embedding_cache_stats, embedding_batcher
+from api.functions.job_search import start_search_workers, stop_search_workers, enqueue_job_search, get_search_progress, get_search_queue_stats, stream_job_search, rescore_job_report
+from api.functions.openai import generate_summary_with_openai
+from api.functions.llm import LLMError
+from api.functions.summary_cache import get_cached_summary, cache_summary
+from api.functions.supabase import save_job_report, delete_job_report
+from api.functions.credits import has_credits, reserve_credit, refund_credit
+from api.functions.metrics import request_timings, observe_request, render_metrics
 
-app = FastAPI(title="Resumatcher")
+async def run_model_prewarm():
+    try:
+        await asyncio.to_thread(prewarm_model)
+    except Exception as e:
+        print(f"Error loading embedding model: {str(e)}")
+
+async def run_job_index_preload():
+    try:
+        await load_job_index()
+    except Exception as e:
+        print(f"Error loading job index: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_search_workers()
+    # Il modello viene caricato in background, il server accetta richieste subito
+    prewarm_task = asyncio.create_task(run_model_prewarm()) if PREWARM_MODEL else None
+    index_task = asyncio.create_task(run_job_index_preload()) if JOB_INDEX_ENABLED and JOB_INDEX_PRELOAD else None
+    yield
+    for task in (prewarm_task, index_task):
+        if task:
+            task.cancel()
+    await stop_search_workers()
+    await close_http_client()
+    shutdown_process_executor()
+
+app = FastAPI(title="Resumatcher", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,66 +59,153 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Cache", "Server-Timing"],
 )
 
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """ Reject CV uploads declaring a body larger than CV_MAX_REQUEST_BYTES before the form is parsed.
+    Uploads without Content-Length are checked on the parsed file in process_cv. """
+    if request.url.path == "/summarize":
+        try:
+            content_length = int(request.headers.get("content-length", "0"))
+        except ValueError:
+            return JSONResponse(status_code=400, content={"detail": "Invalid Content-Length"})
+        if content_length > CV_MAX_REQUEST_BYTES:
+            return JSONResponse(status_code=413, content={"detail": f"File too large, the maximum size is {CV_MAX_BYTES // (1024 * 1024)} MB"})
+    return await call_next(request)
+
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    """ Collect stage timings and external calls of each request and expose them in a Server-Timing header. """
+    start = time.perf_counter()
+    with request_timings() as timings:
+        response = await call_next(request)
+
+    route = request.scope.get("route")
+    observe_request(request.method, route.path if route else "unmatched", response.status_code, time.perf_counter() - start)
+    timings.observe_calls()
+    # Lo stato di una ricerca riporta già i tempi della ricerca in background
+    if "Server-Timing" not in response.headers:
+        response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    cache_stats = get_embedding_cache_stats()
+    batcher_stats = embedding_batcher.get_stats()
+    gauges = {
+        "resumatcher_embedding_cache_hits": ("Embedding cache hits.", cache_stats["hits"]),
+        "resumatcher_embedding_cache_misses": ("Embedding cache misses.", cache_stats["misses"]),
+        "resumatcher_embedding_cache_size": ("Texts in the embedding cache.", cache_stats["size"]),
+        "resumatcher_embedding_batches": ("Micro-batches encoded by the embedding batcher.", batcher_stats["batches"]),
+        "resumatcher_embedding_batch_size_avg": ("Average texts per embedding micro-batch.", batcher_stats["avg_batch_size"]),
+        "resumatcher_embedding_queue_size": ("Encode requests waiting for the embedding batcher.", batcher_stats["queued"]),
+        "resumatcher_model_loaded": ("Whether the embedding model is loaded.", int(is_model_loaded())),
+        "resumatcher_job_index_size": ("Job posts in the in-process vector index.", len(job_index)),
+    }
+    search_stats = get_search_queue_stats()
+    gauges["resumatcher_search_queue_size"] = ("Searches waiting for a worker.", search_stats.pop("queue_size"))
+    for status, count in search_stats.items():
+        gauges[f"resumatcher_searches_{status}"] = (f"Tracked searches with status {status}.", count)
+
+    return render_metrics(gauges)
+
+@app.get("/ready")
+async def readiness(response: Response):
+    model_loaded = is_model_loaded()
+    # Senza pre-warm il modello si carica alla prima ricerca, non blocca la readiness
+    ready = model_loaded or not PREWARM_MODEL
+    if not ready:
+        response.status_code = 503
+
+    return {"ready": ready, "model_loaded": model_loaded}
+
 @app.post("/summarize", response_model=CvSummary)
-async def summarize_cv(user_id: str = Form(...), file: UploadFile = File(...)):
-    if not user_has_credits(user_id):
+async def summarize_cv(response: Response, user_id: str = Form(...), file: UploadFile = File(...)):
+    if not await has_credits(user_id):
         raise HTTPException(status_code=400, detail="Insufficient credits")
     
     cleaned_text = await process_cv(file)
 
+    summary = await get_cached_summary(cleaned_text)
+    if summary:
+        response.headers["X-Cache"] = "HIT"
+        return summary
+
     try:
-        summary = generate_summary_with_openai(cleaned_text)
+        summary = await generate_summary_with_openai(cleaned_text)
+    except LLMError as e:
+        raise HTTPException(status_code=503, detail=f"Error generating summary: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating summary: {e}")
 
+    await cache_summary(cleaned_text, summary)
+    response.headers["X-Cache"] = "MISS"
     return summary
 
-@app.post("/search")
-async def search_jobs_and_create_reports(request: JobSearchRequest):
-    if not user_has_credits(request.user_id):
-        raise HTTPException(status_code=400, detail="Insufficient credits")
-    
+async def start_search(request: JobSearchRequest):
+    """ Reserve the credit of a search and create its report, refunding the credit if that fails. """
+    reservation = await reserve_credit(request.user_id)
     try:
-        jobs = fetch_jobs_from_api(request.role, request.location)
-
-        if not jobs:
-            raise HTTPException(status_code=404, detail="No jobs found for the given role and location")
-
-        job_report_id = save_job_report(request)
-
-        # Pre-process CV data once
-        cv_vectors = preprocess_cv(request)
+        job_report_id = await save_job_report(request)
+    except HTTPException:
+        await refund_credit(request.user_id, reservation)
+        raise
 
-        # Save all jobs first
-        saved_jobs = []
-        for job in jobs:
-            try:
-                saved_job = save_job_post(job)
-                if saved_job:
-                    saved_jobs.append(saved_job)
-            except Exception as e:
-                print(f"Error saving job: {str(e)}")
+    return job_report_id, reservation
 
-        # Calculate all match scores in batch
-        match_scores = calculate_match_scores_batch(cv_vectors, saved_jobs)
-
-        # Save all match scores and create associations
-        for saved_job, match_score in zip(saved_jobs, match_scores):
-            try:
-                match_score_id = save_match_score(request.user_id, saved_job["id"], job_report_id, match_score)
-                if match_score_id:
-                    create_report_post_association(job_report_id, saved_job["id"])
-            except Exception as e:
-                print(f"Error saving match score: {str(e)}")
-
-        update_credits(request.user_id)
-        return {"message": "Job search and report creation completed successfully"}
+@app.post("/search", status_code=202)
+async def search_jobs_and_create_reports(request: JobSearchRequest):
+    job_report_id, reservation = await start_search(request)
 
-    except Exception as e:
-        print(f"Error in job search: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error searching jobs: {e}")
+    try:
+        enqueue_job_search(job_report_id, request, reservation)
+    except HTTPException:
+        await refund_credit(request.user_id, reservation)
+        await delete_job_report(job_report_id)
+        raise
+
+    return {"message": "Job search started", "job_report_id": job_report_id}
+
+async def format_server_sent_events(events):
+    """ Encode (event, payload) pairs as Server-Sent Events. """
+    async for event, payload in events:
+        data = payload.model_dump() if hasattr(payload, "model_dump") else {"detail": payload}
+        yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/search/stream")
+async def stream_search_results(request: JobSearchRequest):
+    """ Same search as /search, streamed as Server-Sent Events: a "job" event per scored job,
+    then a "done" event with the job_report_id and the credits left, or an "error" event. """
+    job_report_id, reservation = await start_search(request)
+
+    return StreamingResponse(
+        format_server_sent_events(stream_job_search(job_report_id, request, reservation)),
+        media_type="text/event-stream",
+        # Evita il buffering dei proxy, gli eventi devono arrivare subito
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/search/{job_report_id}/rescore", status_code=201, response_model=RescoreCompleted)
+async def rescore_search(job_report_id: str, request: JobSearchRequest):
+    """ Re-score the jobs of an existing report against an updated CV, saved as a new report.
+    Only skills, years_experience and filename are taken from the request, role and location
+    stay those of the original search. Does not fetch or embed jobs again and does not use a credit. """
+    return await rescore_job_report(job_report_id, request)
+
+@app.get("/search/{job_report_id}/status", response_model=SearchProgress)
+async def get_job_search_status(job_report_id: str, response: Response):
+    progress = get_search_progress(job_report_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="Job search not found")
+
+    if progress.timings:
+        entries = [f"{stage};dur={duration}" for stage, duration in progress.timings.items()]
+        entries += [f'{kind};desc="{count} calls"' for kind, count in progress.calls.items()]
+        response.headers["Server-Timing"] = ", ".join(entries)
+
+    return progress
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, timeout_keep_alive=660)
+    uvicorn.run(app, host="0.0.0.0", port=8000)
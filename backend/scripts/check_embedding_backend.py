@@ -0,0 +1,114 @@
+""" Compare the match scores of an embedding backend against the fp32 torch baseline.
+
+Encodes the CVs and jobs in scripts/fixtures/match_fixtures.json with both backends,
+scores them with the same code used by calculate_match_scores_batch and reports the
+score drift, encode latency and resident memory of each backend.
+
+Usage, from the backend directory:
+    python -m scripts.check_embedding_backend --backend onnx-int8 --max-drift 3
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from api.models.models import JobSearchRequest
+from api.functions.match_score import load_model, build_job_texts, build_cv_texts, score_job_vectors, EMBEDDING_BACKENDS, MAX_TEXT_LENGTH
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "match_fixtures.json")
+
+def current_rss_mb() -> float | None:
+    """ Resident memory of this process, read from /proc (Linux only). """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+def encode(model, texts: list):
+    truncated_texts = [text[:MAX_TEXT_LENGTH] for text in texts]
+    return model.encode(truncated_texts, convert_to_tensor=True, batch_size=len(truncated_texts)).cpu()
+
+def score_fixtures(model, fixtures: dict) -> list:
+    """ Scores of every fixture job for every fixture CV, as a list of rows (one per CV). """
+    jobs = fixtures["jobs"]
+    job_vectors = encode(model, [text for job in jobs for text in build_job_texts(job)]).reshape(len(jobs), 3, -1)
+
+    scores = []
+    for cv in fixtures["cvs"]:
+        cv_data = JobSearchRequest(**cv, user_id="fixture", filename="fixture.pdf")
+        role_vector, location_vector, skills_vector = encode(model, build_cv_texts(cv_data))
+        cv_vectors = {
+            'role': role_vector,
+            'location': location_vector,
+            'skills': skills_vector,
+            'years_experience': cv_data.years_experience
+        }
+        scores.append(score_job_vectors(cv_vectors, job_vectors, [job.get("years_experience") for job in jobs]))
+    return scores
+
+def measure_backend(backend: str, fixtures: dict, repeat: int) -> dict:
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    model = load_model(backend)
+    load_seconds = time.perf_counter() - start
+    rss_after = current_rss_mb()
+
+    # Il primo giro fa da warm-up e non viene misurato
+    scores = score_fixtures(model, fixtures)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        score_fixtures(model, fixtures)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "backend": backend,
+        "scores": scores,
+        "load_seconds": load_seconds,
+        "median_seconds": statistics.median(timings),
+        "rss_delta_mb": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=EMBEDDING_BACKENDS, default="onnx-int8")
+    parser.add_argument("--max-drift", type=int, default=3, help="maximum allowed absolute score difference")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per backend")
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    args = parser.parse_args()
+
+    with open(args.fixtures) as fixtures_file:
+        fixtures = json.load(fixtures_file)
+
+    baseline = measure_backend("torch", fixtures, args.repeat)
+    candidate = measure_backend(args.backend, fixtures, args.repeat)
+
+    drifts = [
+        abs(baseline_score - candidate_score)
+        for baseline_row, candidate_row in zip(baseline["scores"], candidate["scores"])
+        for baseline_score, candidate_score in zip(baseline_row, candidate_row)
+    ]
+    max_drift = max(drifts)
+
+    for result in (baseline, candidate):
+        rss = f"{result['rss_delta_mb']:.0f} MB" if result["rss_delta_mb"] is not None else "n/a"
+        print(f"{result['backend']:>10}: load {result['load_seconds']:.2f}s, "
+              f"scoring {result['median_seconds'] * 1000:.1f} ms, model RSS {rss}")
+
+    print(f"{len(drifts)} scores compared: max drift {max_drift}, mean drift {statistics.mean(drifts):.2f}, "
+          f"exact matches {sum(drift == 0 for drift in drifts)}")
+
+    if max_drift > args.max_drift:
+        print(f"FAIL: drift {max_drift} exceeds --max-drift {args.max_drift}")
+        return 1
+
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+""" Backfill or refresh the requirements of the stored job posts in bulk.
+
+Reads job_posts page by page, re-extracts requirements with the batched LLM prompt
+(REQUIREMENTS_BATCH_SIZE descriptions per call) and writes them back with one upsert
+on job_id per batch. Stale job embeddings are re-encoded on the next search, since
+their text hash no longer matches.
+
+Usage, from the backend directory:
+    python -m scripts.enrich_job_posts                # only jobs without requirements
+    python -m scripts.enrich_job_posts --refresh      # every job
+    python -m scripts.enrich_job_posts --dry-run --limit 100
+"""
+import sys
+import asyncio
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from api.functions.supabase import get_job_posts_page
+from api.functions.ingestion import refresh_job_requirements, JOB_INGESTION_CONCURRENCY
+
+async def enrich_job_posts(refresh: bool, page_size: int, limit: int | None, concurrency: int, dry_run: bool) -> int:
+    """ Returns the number of job posts whose extraction failed. """
+    selected, updated, offset = 0, 0, 0
+    while limit is None or selected < limit:
+        # Le righe aggiornate mantengono l'id, quindi la paginazione per id resta stabile
+        rows = await get_job_posts_page(offset, page_size)
+        offset += page_size
+
+        pending = [row for row in rows if refresh or not row.get("requirements")]
+        if limit is not None:
+            pending = pending[:limit - selected]
+        selected += len(pending)
+
+        if pending and not dry_run:
+            updated += len(await refresh_job_requirements(pending, concurrency))
+        if pending:
+            print(f"{selected} job posts {'selected' if dry_run else 'processed'}, {updated} updated")
+        if len(rows) < page_size:
+            break
+
+    print(f"Done: {selected} job posts {'would be updated' if dry_run else 'processed'}, {updated} updated")
+    return 0 if dry_run else selected - updated
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--refresh", action="store_true", help="re-extract requirements of every job, not only the missing ones")
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many job posts")
+    parser.add_argument("--concurrency", type=int, default=JOB_INGESTION_CONCURRENCY, help="LLM batches in flight")
+    parser.add_argument("--dry-run", action="store_true", help="only count the job posts that would be updated")
+    args = parser.parse_args()
+
+    failed = asyncio.run(enrich_job_posts(args.refresh, args.page_size, args.limit, args.concurrency, args.dry_run))
+    if failed:
+        print(f"{failed} job posts could not be updated")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,6 +22,10 @@ import { useUser } from "@clerk/nextjs";
 import { useQuery, useQueryClient } from "@tanstack/react-query";
 import { getUserSubscription } from "@/utils/supabase/actions/userActions";
 
+// Polling dello stato della ricerca: oltre SEARCH_TIMEOUT_MS viene considerata bloccata
+const SEARCH_POLL_INTERVAL_MS = 2000;
+const SEARCH_TIMEOUT_MS = 5 * 60 * 1000;
+
 function UploadCv() {
   const { user } = useUser();
   const queryClient = useQueryClient();
@@ -153,21 +157,44 @@ function UploadCv() {
         },
       });
 
-      if (response.status === 200) {
-        // Invalida la cache per la query dei report
-        queryClient.invalidateQueries({ queryKey: ["reports"] });
-        
-        // Invalida la cache per la query dei crediti/subscription
-        queryClient.invalidateQueries({ queryKey: ["subscription", user?.id] });
-        
-        toast.success("Job search completed successfully, redirecting to job reports page", {
-          richColors: true,
-          duration: 4000,
-        });
-        setTimeout(() => {
-          router.push("/reports");
-        }, 1000);
+      // La ricerca gira in background, controlla lo stato finché non termina
+      const jobReportId = response.data.job_report_id;
+      let status = "queued";
+      const deadline = Date.now() + SEARCH_TIMEOUT_MS;
+      while (status !== "completed") {
+        if (Date.now() > deadline) {
+          toast.warning("The job search is taking too long, please check your reports later.", {
+            richColors: true,
+            duration: 4000,
+          });
+          return;
+        }
+        await new Promise((resolve) => setTimeout(resolve, SEARCH_POLL_INTERVAL_MS));
+        const statusResponse = await axios.get(`${process.env.NEXT_PUBLIC_BACKEND_URL}/search/${jobReportId}/status`);
+        status = statusResponse.data.status;
+
+        if (status === "failed") {
+          toast.warning(`Error: ${statusResponse.data.error}`, {
+            richColors: true,
+            duration: 4000,
+          });
+          return;
+        }
       }
+
+      // Invalida la cache per la query dei report
+      queryClient.invalidateQueries({ queryKey: ["reports"] });
+      
+      // Invalida la cache per la query dei crediti/subscription
+      queryClient.invalidateQueries({ queryKey: ["subscription", user?.id] });
+      
+      toast.success("Job search completed successfully, redirecting to job reports page", {
+        richColors: true,
+        duration: 4000,
+      });
+      setTimeout(() => {
+        router.push("/reports");
+      }, 1000);
     } catch (err) {
       if (axios.isAxiosError(err) && err.response) {
         console.log(err.response.data)
@@ -71,12 +71,31 @@ CREATE TABLE job_report_posts (
   UNIQUE(job_report_id, job_post_id) -- Evita duplicati
 );
 
+-- Embedding dei job post, invalidati quando cambia l'hash del testo codificato
+CREATE TABLE public.job_post_embeddings (
+  job_post_id UUID PRIMARY KEY REFERENCES job_posts(id) ON DELETE CASCADE,
+  text_hash TEXT NOT NULL,
+  role_embedding REAL[] NOT NULL,
+  location_embedding REAL[] NOT NULL,
+  skills_embedding REAL[] NOT NULL,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Cache dei riepiloghi CV generati da /summarize, chiave: hash del testo pulito
+CREATE TABLE public.cv_summaries (
+  text_hash TEXT PRIMARY KEY,
+  summary JSONB NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 ALTER TABLE public.users ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.job_reports ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.job_posts ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.match_scores ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.subscriptions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.job_report_posts ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.job_post_embeddings ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.cv_summaries ENABLE ROW LEVEL SECURITY;
 
 -- Policy for users table - users can only read and update their own profile
 CREATE POLICY "Users can view own profile" 
@@ -177,4 +196,48 @@ $$ LANGUAGE plpgsql SECURITY DEFINER;
 -- Crea il trigger che si attiva dopo l'inserimento di un nuovo utente
 CREATE TRIGGER on_auth_user_created
 AFTER INSERT ON public.users
-FOR EACH ROW EXECUTE FUNCTION public.create_default_subscription();
\ No newline at end of file
+FOR EACH ROW EXECUTE FUNCTION public.create_default_subscription();
+-- Prenotazione atomica del credito di una ricerca: un solo UPDATE condizionale, così due
+-- ricerche concorrenti dello stesso utente non possono spendere lo stesso credito.
+-- allowed: la ricerca può partire; reserved: è stato scalato un credito (solo piano free)
+CREATE OR REPLACE FUNCTION public.reserve_search_credit(p_user_id TEXT)
+RETURNS JSONB AS $$
+DECLARE
+  v_plan TEXT;
+  v_credits INT;
+BEGIN
+  UPDATE public.subscriptions
+  SET credits = credits - 1, updated_at = NOW()
+  WHERE user_id = p_user_id AND plan = 'free' AND credits > 0
+  RETURNING plan, credits INTO v_plan, v_credits;
+
+  IF FOUND THEN
+    RETURN jsonb_build_object('plan', v_plan, 'credits', v_credits, 'allowed', true, 'reserved', true);
+  END IF;
+
+  SELECT plan, credits INTO v_plan, v_credits
+  FROM public.subscriptions
+  WHERE user_id = p_user_id;
+
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+
+  RETURN jsonb_build_object('plan', v_plan, 'credits', v_credits, 'allowed', v_plan <> 'free', 'reserved', false);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Restituisce il credito prenotato da una ricerca fallita
+CREATE OR REPLACE FUNCTION public.refund_search_credit(p_user_id TEXT)
+RETURNS INT AS $$
+  UPDATE public.subscriptions
+  SET credits = credits + 1, updated_at = NOW()
+  WHERE user_id = p_user_id AND plan = 'free'
+  RETURNING credits;
+$$ LANGUAGE sql SECURITY DEFINER;
+
+-- Solo il backend (service role) può prenotare e restituire crediti
+REVOKE EXECUTE ON FUNCTION public.reserve_search_credit(TEXT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.refund_search_credit(TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.reserve_search_credit(TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION public.refund_search_credit(TEXT) TO service_role;